@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks for python-ems. Each module is run with python -m, e.g.
+
+    python -m benchmarks.params
+
+and prints its results as a JSON document.
+"""
+
+import gc
+import json
+import platform
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def best_time(func, number, repeat=5):
+    """
+    Returns the best time in seconds of a single call to func, out of repeat
+    runs of number calls.
+    """
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def peak_memory(func):
+    """
+    Returns the peak number of bytes allocated by Python while calling func,
+    or None if tracemalloc is unavailable. Memory allocated by lxml outside
+    of the Python allocator is not included.
+    """
+    if tracemalloc is None:
+        return None
+
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def emit(benchmark, results, out=None):
+    """
+    Writes the results of a benchmark, a list of dicts, as JSON to the given
+    file, or stdout.
+    """
+    if out is None:
+        out = sys.stdout
+
+    doc = {
+        'benchmark': benchmark,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'results': results,
+    }
+
+    json.dump(doc, out, indent=2, sort_keys=True)
+    out.write('\n')
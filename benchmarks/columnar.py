@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of decoding the contacts of a SearchContactsResponse into objects
+and into a columnar table, measuring the time taken and the memory held by
+the result per contact.
+
+    python -m benchmarks.columnar [--count 10000] [-o FILE]
+"""
+
+import argparse
+import gc
+import io
+
+from ems.schema import table
+from ems.types import contacts
+
+from benchmarks import best_time
+from benchmarks import emit
+from benchmarks import fixtures
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+PATH = ('contacts', 'contact')
+
+
+def retained_memory(func):
+    """
+    Returns the number of bytes allocated by Python which are still held once
+    func returns, or None if tracemalloc is unavailable.
+    """
+    if tracemalloc is None:
+        return None
+
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        result = func()
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0]
+
+        del result
+        return retained
+    finally:
+        tracemalloc.stop()
+
+
+def run(count, repeat):
+    cls = contacts.SearchContactsResponse
+    text = fixtures.search_contacts_response(count=count).render()
+
+    cases = [
+        ('objects', lambda: list(cls.iterparse(io.BytesIO(text), PATH))),
+        ('table', lambda: table.Table.from_file(cls, io.BytesIO(text), PATH)),
+    ]
+
+    results = []
+
+    for name, func in cases:
+        retained = retained_memory(func)
+
+        results.append({
+            'name': name,
+            'contacts': count,
+            'seconds': best_time(func, number=1, repeat=repeat),
+            'retained_bytes': retained,
+            'bytes_per_contact': retained / count if retained else None,
+        })
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--count', type=int, default=10000,
+                        help='Number of contacts in the response')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timed runs of each case')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                        help='File to write the JSON results to')
+    args = parser.parse_args(argv)
+
+    emit('columnar', run(args.count, args.repeat), out=args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of parsing the dates of a SearchContactsResponse with 10k
+contacts, with dateutil, the ISO 8601 path of the Date field and its cache.
+
+    python -m benchmarks.dates [--count 10000] [-o FILE]
+"""
+
+import argparse
+
+import dateutil.parser
+
+from ems.schema import fields
+from ems.types import contacts
+
+from benchmarks import best_time
+from benchmarks import emit
+from benchmarks import fixtures
+
+
+def run(count, repeat):
+    response = fixtures.search_contacts_response(count=count)
+    text = response.render().decode('utf-8')
+
+    dates = [c.create_date.isoformat() for c in response.contacts.contact]
+    field = fields.factory('date')
+
+    def iso():
+        field._cache.clear()
+        return [field.from_text(d) for d in dates]
+
+    def parse():
+        field._cache.clear()
+        return contacts.SearchContactsResponse.from_text(text)
+
+    cases = [
+        ('dateutil', lambda: [dateutil.parser.parse(d) for d in dates]),
+        ('iso', iso),
+        # The same 100 dates repeated, as for the start and end dates of
+        # entitlements
+        ('cached', lambda: [field.from_text(dates[i % 100])
+                            for i in range(len(dates))]),
+        ('search_contacts.from_text', parse),
+    ]
+
+    results = []
+
+    for name, func in cases:
+        seconds = best_time(func, number=1, repeat=repeat)
+
+        results.append({
+            'name': name,
+            'dates': len(dates),
+            'seconds': seconds,
+            'dates_per_second': len(dates) / seconds,
+        })
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--count', type=int, default=10000,
+                        help='Number of contacts in the response')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timed runs of each case')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                        help='File to write the JSON results to')
+    args = parser.parse_args(argv)
+
+    emit('dates', run(args.count, args.repeat), out=args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,564 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A local stand-in for the Sentinel EMS API, for load testing ApiSession.
+
+It serves the calls made by ApiSession from an in-memory dataset, rendering
+its responses with the ems.types classes. Responses can be delayed and
+errors injected with the codes of ems.exceptions.
+
+    python -m benchmarks.fakeems --port 8080 --contacts 100000 --latency 0.01
+"""
+
+import argparse
+import random
+import re
+import threading
+import uuid
+
+import six
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib import parse as urlparse
+
+from ems import exceptions as exc
+from ems.types import contacts
+from ems.types import customers
+from ems.types import entitlements
+from ems.types import errors
+from ems.types import login
+
+
+SESSION_COOKIE = 'JSESSIONID'
+
+ENTITLEMENT_PATH = re.compile(r'^/v4_0/ws/entitlement(?:/([^/]+))?\.ws$')
+
+
+class FakeEMSError(Exception):
+    """
+    Raised by a handler to respond with an EMS error.
+    """
+    def __init__(self, code, description=None):
+        self.code = code
+        self.description = description or exc.api_exceptions[code].__name__
+        super(FakeEMSError, self).__init__(self.description)
+
+
+class Dataset(object):
+    """
+    The customers, contacts and entitlements held by the fake EMS.
+    """
+    def __init__(self, num_customers=0, num_contacts=0):
+        self.lock = threading.Lock()
+
+        # Id -> dict of fields
+        self.customers = {}
+        self.contacts = {}
+
+        # Customer name -> id, and contact email address -> id
+        self.customer_names = {}
+        self.contact_emails = {}
+
+        # Id -> rendered Entitlement
+        self.entitlements = {}
+
+        for i in range(num_customers):
+            self.add_customer(name='Customer %d' % i, crm_id='CRM%d' % i)
+
+        for i in range(num_contacts):
+            customer = i % num_customers + 1 if num_customers else None
+            self.add_contact(email='contact%d@example.com' % i,
+                             name='Contact %d' % i, customer=customer)
+
+    def add_customer(self, name, **kwds):
+        with self.lock:
+            if name in self.customer_names:
+                raise FakeEMSError(521)
+
+            id_ = len(self.customers) + 1
+            self.customers[id_] = dict(kwds, id=id_, name=name)
+            self.customer_names[name] = id_
+
+        return id_
+
+    def add_contact(self, email, **kwds):
+        with self.lock:
+            if email in self.contact_emails:
+                raise FakeEMSError(529)
+
+            id_ = len(self.contacts) + 1
+            self.contacts[id_] = dict(kwds, id=id_, email=email)
+            self.contact_emails[email] = id_
+
+        return id_
+
+    def update_customer(self, customer, **kwds):
+        """
+        Updates the fields of a customer, keeping its name unique.
+        """
+        with self.lock:
+            name = kwds.get('name', customer['name'])
+
+            if name != customer['name']:
+                if name in self.customer_names:
+                    raise FakeEMSError(521)
+
+                del self.customer_names[customer['name']]
+                self.customer_names[name] = customer['id']
+
+            customer.update(kwds)
+
+    def update_contact(self, contact, **kwds):
+        """
+        Updates the fields of a contact, keeping its email address unique.
+        """
+        with self.lock:
+            email = kwds.get('email', contact['email'])
+
+            if email != contact['email']:
+                if email in self.contact_emails:
+                    raise FakeEMSError(529)
+
+                del self.contact_emails[contact['email']]
+                self.contact_emails[email] = contact['id']
+
+            contact.update(kwds)
+
+    def find_customer(self, name):
+        return self.customers.get(self.customer_names.get(name))
+
+    def find_contact(self, email):
+        return self.contacts.get(self.contact_emails.get(email))
+
+
+class FakeEMS(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded HTTP server standing in for EMS.
+
+    latency is the number of seconds each response is delayed by, with up to
+    jitter seconds added at random. error_rate is the fraction of requests
+    after login which fail with one of error_codes. If max_in_flight is
+    given, requests made while that many are being handled fail with an
+    InternalErrorException (107), as EMS does when overloaded.
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), dataset=None, latency=0,
+                 jitter=0, error_rate=0, error_codes=(107, 127),
+                 max_in_flight=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, _Handler)
+
+        self.dataset = dataset or Dataset()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.max_in_flight = max_in_flight
+
+        self.sessions = set()
+        self.requests = 0
+        self.in_flight = 0
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % self.server_address[:2]
+
+    def start(self):
+        """
+        Serves requests on a daemon thread, returning the thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # Send the headers and body of a response in one packet
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    # Request helpers
+
+    def _params(self):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+
+        if self.headers.get('Content-Type', '').startswith(
+                'application/x-www-form-urlencoded'):
+            params.update(urlparse.parse_qsl(self.body.decode('utf-8')))
+
+        return url.path, params
+
+    def _session(self):
+        for cookie in self.headers.get('Cookie', '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+
+            if name == SESSION_COOKIE:
+                return value
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+
+        for k, v in six.iteritems(headers or {}):
+            self.send_header(k, v)
+
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_obj(self, obj, status=200, headers=None):
+        self._send(status, obj.render(), headers)
+
+    def _send_error(self, path, error):
+        # The REST API gives errors in a header, the XML API in the body
+        if ENTITLEMENT_PATH.match(path):
+            self._send(400, error.description.encode('utf-8'),
+                       {'errorCode': str(error.code)})
+        else:
+            self._send_obj(errors.ErrorResponse(
+                code=error.code, description=error.description,
+                status='fail'))
+
+    def _handle(self, method):
+        server = self.server
+        path, params = self._params()
+
+        with server.dataset.lock:
+            server.requests += 1
+            server.in_flight += 1
+            in_flight = server.in_flight
+
+        try:
+            if server.latency or server.jitter:
+                threading.Event().wait(server.latency +
+                                       random.random() * server.jitter)
+
+            self._dispatch(method, path, params, in_flight)
+        finally:
+            with server.dataset.lock:
+                server.in_flight -= 1
+
+    def _dispatch(self, method, path, params, in_flight):
+        server = self.server
+
+        try:
+            if path == '/verifyLogin.xml':
+                return self.verify_login(params)
+
+            if self._session() not in server.sessions:
+                raise FakeEMSError(128)
+
+            if server.max_in_flight and in_flight > server.max_in_flight:
+                raise FakeEMSError(107)
+
+            if server.error_rate and random.random() < server.error_rate:
+                raise FakeEMSError(random.choice(server.error_codes))
+
+            match = ENTITLEMENT_PATH.match(path)
+
+            if match is not None:
+                handler = getattr(self, 'entitlement_%s' % method.lower())
+                return handler(match.group(1), params)
+
+            handler = _XML_CALLS.get((method, path))
+
+            if handler is None:
+                return self._send(404)
+
+            return handler(self, params)
+
+        except FakeEMSError as e:
+            self._send_error(path, e)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    # XML API
+
+    def verify_login(self, params):
+        if not params.get('userName') or not params.get('password'):
+            raise FakeEMSError(526)
+
+        session = uuid.uuid4().hex
+        self.server.sessions.add(session)
+
+        self._send_obj(
+            login.LoginResponse(session_id=session, status='ok'),
+            headers={'Set-Cookie': '%s=%s; Path=/' % (SESSION_COOKIE,
+                                                      session)})
+
+    def _page(self, items, params):
+        size = int(params.get('pageSize') or 100)
+        index = int(params.get('pageIndex') or 1)
+        return items[(index - 1) * size:index * size]
+
+    def create_contact(self, params):
+        customer = params.get('customerId')
+
+        id_ = self.server.dataset.add_contact(
+            email=params['emailId'], name=params.get('contactName'),
+            customer=int(customer) if customer else None,
+            ref1=params.get('refId1'), ref2=params.get('refId2'))
+
+        self._send_obj(contacts.CreateContactResponse(id=id_, status='ok'))
+
+    def _contact(self, params):
+        contact = self.server.dataset.contacts.get(int(params['contactId']))
+
+        if contact is None:
+            raise FakeEMSError(518)
+
+        return contact
+
+    def update_contact(self, params):
+        contact = self._contact(params)
+        fields = {'email': params['emailId']}
+
+        for param, field in (('contactName', 'name'), ('refId1', 'ref1'),
+                             ('refId2', 'ref2')):
+            if param in params:
+                fields[field] = params[param]
+
+        self.server.dataset.update_contact(contact, **fields)
+
+        self._send_obj(contacts.UpdateContactResponse(status='ok'))
+
+    def associate_contact(self, params):
+        contact = self._contact(params)
+
+        if int(params['customerId']) not in self.server.dataset.customers:
+            raise FakeEMSError(512)
+
+        contact['customer'] = int(params['customerId'])
+        self._send_obj(contacts.AssociateContactResponse(status='ok'))
+
+    def get_contact_by_email(self, params):
+        dataset = self.server.dataset
+
+        contact = dataset.find_contact(params['emailId'])
+
+        if contact is None:
+            raise FakeEMSError(513)
+
+        customer = dataset.customers.get(contact.get('customer'))
+        Response = contacts.ContactDetailsResponse
+
+        self._send_obj(Response(
+            id=contact['id'], email=contact['email'], name=contact['name'],
+            ref1=contact.get('ref1'), ref2=contact.get('ref2'),
+            login_allowed=True, status='ok',
+            customer=Response.Customer(id=customer['id'],
+                                       name=customer['name'])
+            if customer else None))
+
+    def search_contacts(self, params):
+        dataset = self.server.dataset
+        Response = contacts.SearchContactsResponse
+        Contact = Response.ContactList.Contact
+
+        found = [c for c in list(dataset.contacts.values())
+                 if c['email'] == params.get('emailId', c['email'])]
+
+        page = []
+        for contact in self._page(found, params):
+            customer = dataset.customers.get(contact.get('customer'), {})
+            page.append(Contact(
+                id=contact['id'], email=contact['email'],
+                name=contact['name'], customer_id=customer.get('id'),
+                customer_name=customer.get('name'), admin=False,
+                status=True, ref1=contact.get('ref1')))
+
+        self._send_obj(Response(
+            status='ok', total=len(found),
+            contacts=Response.ContactList(contact=page)))
+
+    def create_customer(self, params):
+        id_ = self.server.dataset.add_customer(
+            name=params['customerName'], crm_id=params.get('crmId'),
+            ref=params.get('refId'))
+
+        self._send_obj(customers.CreateCustomerResponse(id=id_, status='ok'))
+
+    def get_customer_by_name(self, params):
+        dataset = self.server.dataset
+
+        customer = dataset.find_customer(params['customerName'])
+
+        if customer is None:
+            raise FakeEMSError(512)
+
+        Response = customers.CustomerDetailsResponse
+        Contact = Response.ContactList.Contact
+
+        self._send_obj(Response(
+            id=customer['id'], name=customer['name'],
+            crm_id=customer.get('crm_id'), ref=customer.get('ref'),
+            enabled=True, status='ok',
+            contacts=Response.ContactList(contact=[
+                Contact(id=c['id'], email=c['email'], name=c['name'])
+                for c in list(dataset.contacts.values())
+                if c.get('customer') == customer['id']
+            ])))
+
+    def update_customer(self, params):
+        customer = self.server.dataset.customers.get(
+            int(params['customerId']))
+
+        if customer is None:
+            raise FakeEMSError(512)
+
+        fields = {}
+
+        for param, field in (('customerName', 'name'), ('crmId', 'crm_id'),
+                             ('refId', 'ref')):
+            if param in params:
+                fields[field] = params[param]
+
+        self.server.dataset.update_customer(customer, **fields)
+
+        self._send_obj(customers.UpdateCustomerResponse(status='ok'))
+
+    def search_customers(self, params):
+        Response = customers.SearchCustomersResponse
+        Customer = Response.CustomerList.Customer
+
+        found = [c for c in list(self.server.dataset.customers.values())
+                 if c['name'] == params.get('customerName', c['name'])]
+
+        self._send_obj(Response(
+            status='ok', total=len(found),
+            customers=Response.CustomerList(customer=[
+                Customer(id=c['id'], name=c['name'], crm_id=c.get('crm_id'),
+                         ref=c.get('ref'), enabled=True)
+                for c in self._page(found, params)
+            ])))
+
+    # REST API
+
+    def entitlement_put(self, ent_id, params):
+        ent = entitlements.Entitlement.from_text(self.body.decode('utf-8'))
+        ent.eid = uuid.uuid4().hex
+
+        # EMS fills in the features and license models of the products
+        for key in ent.product_key or []:
+            for item in key.item or []:
+                for product in item.product or []:
+                    Feature = product.Feature
+                    Model = Feature.LicenseModel
+
+                    product.feature = [Feature(
+                        identifier=Feature.FeatureIdentifier(id=1),
+                        license_model=[Model(
+                            identifier=Model.LicenseModelIdentifier(
+                                name='Standalone'),
+                            attribute=[
+                                Model.LicenseModelAttribute(name=name)
+                                for name in ('START_DATE', 'END_DATE',
+                                             'CONCURRENT_INSTANCES')
+                            ])])]
+
+        dataset = self.server.dataset
+        with dataset.lock:
+            ent_id = str(len(dataset.entitlements) + 1)
+            dataset.entitlements[ent_id] = ent.render()
+
+        self._send(201, headers={'Location': ent_id})
+
+    def _entitlement(self, ent_id):
+        body = self.server.dataset.entitlements.get(ent_id)
+
+        if body is None:
+            raise FakeEMSError(125)
+
+        return body
+
+    def entitlement_get(self, ent_id, params):
+        self._send(200, self._entitlement(ent_id))
+
+    def entitlement_post(self, ent_id, params):
+        self._entitlement(ent_id)
+
+        # Check the entitlement is valid before storing it
+        ent = entitlements.Entitlement.from_text(self.body.decode('utf-8'))
+        self.server.dataset.entitlements[ent_id] = ent.render()
+
+        self._send(200, self.server.dataset.entitlements[ent_id])
+
+
+# (Method, path) -> handler for the XML API
+_XML_CALLS = {
+    ('POST', '/createContact.xml'): _Handler.create_contact,
+    ('POST', '/updateContact.xml'): _Handler.update_contact,
+    ('POST', '/associateContactWithCustomer.xml'): _Handler.associate_contact,
+    ('GET', '/getContactByEmailId.xml'): _Handler.get_contact_by_email,
+    ('POST', '/searchContacts.xml'): _Handler.search_contacts,
+    ('POST', '/createCustomer.xml'): _Handler.create_customer,
+    ('GET', '/getCustomerByCustomerName.xml'): _Handler.get_customer_by_name,
+    ('POST', '/updateCustomer.xml'): _Handler.update_customer,
+    ('GET', '/searchCustomers.xml'): _Handler.search_customers,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--contacts', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--error-code', type=int, action='append',
+                        help='EMS error code to inject; may be repeated')
+    parser.add_argument('--max-in-flight', type=int,
+                        help='Requests handled at once before failing with '
+                             '107')
+    args = parser.parse_args(argv)
+
+    server = FakeEMS(
+        (args.host, args.port),
+        dataset=Dataset(args.customers, args.contacts),
+        latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_codes=args.error_code or (107, 127),
+        max_in_flight=args.max_in_flight,
+    )
+
+    print('Serving fake EMS on %s' % server.url)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Generators of realistic EMS payloads
+"""
+
+import datetime
+
+from ems.types import contacts
+from ems.types import customers
+from ems.types import entitlements
+
+
+START_DATE = datetime.datetime(2016, 1, 1)
+
+
+def entitlement(product_keys=20, features=5, license_models=2,
+                attributes=8, history=10):
+    """
+    Returns an Entitlement as it is returned by EMS once committed, with the
+    given number of ProductKeys, each with one ProductKeyItem for a product
+    of the given number of features and license models per feature.
+    """
+    Ent = entitlements.Entitlement
+    Key = Ent.ProductKey
+    Item = Key.ProductKeyItem
+    Product = Item.Product
+    Feature = Product.Feature
+    Model = Feature.LicenseModel
+
+    ent = Ent.create(
+        start_date=START_DATE, end_date=START_DATE + datetime.timedelta(365),
+        num_activations=10, products={}, customer_id=1000, contact_id=2000,
+        cc_email='licensing@example.com', ref1='SO-1234', ref2='PO-5678',
+    )
+
+    ent.eid = 'a1b2c3d4-e5f6-4a5b-8c9d-0e1f2a3b4c5d'
+    ent.lifecycle_stage = 'COMMITTED'
+    ent.revision = '3'
+
+    ent.txn_history = [
+        Ent.TxnHistory(eid=ent.eid, ent_id='1', operation='UPDATE',
+                       date=START_DATE + datetime.timedelta(hours=i),
+                       by='admin')
+        for i in range(history)
+    ]
+
+    keys = []
+    for k in range(product_keys):
+        product = Product(
+            identifier=Product.ProductIdentifier(
+                id=k,
+                name_version=Product.ProductIdentifier.ProductNameVersion(
+                    name='Product %d' % k, version='1.0'),
+            ),
+            feature=[
+                Feature(
+                    identifier=Feature.FeatureIdentifier(
+                        id=f, identity='feature-%d-%d' % (k, f)),
+                    license_model=[
+                        Model(
+                            identifier=Model.LicenseModelIdentifier(
+                                id=m, name='Model %d' % m),
+                            attribute=[
+                                Model.LicenseModelAttribute(
+                                    name='ATTRIBUTE_%d' % a, value=str(a))
+                                for a in range(attributes - 2)
+                            ] + [
+                                Model.LicenseModelAttribute(
+                                    name='START_DATE', value='2016-01-01'),
+                                Model.LicenseModelAttribute(
+                                    name='END_DATE', value='2016-12-31'),
+                            ],
+                        )
+                        for m in range(license_models)
+                    ],
+                )
+                for f in range(features)
+            ],
+        )
+
+        item = Item(id=k, total_quantity=10, available_quantity=10,
+                    activation_method='PARTIAL', product=[product])
+
+        keys.append(Key(id='pk-%d' % k, start_date=START_DATE,
+                        end_date=START_DATE + datetime.timedelta(365),
+                        item=[item]))
+
+    ent.product_key = keys
+    return ent
+
+
+def search_contacts_response(count=10000):
+    """
+    Returns a SearchContactsResponse with the given number of contacts.
+    """
+    Contact = contacts.SearchContactsResponse.ContactList.Contact
+
+    return contacts.SearchContactsResponse(
+        status='ok',
+        total=count,
+        contacts=contacts.SearchContactsResponse.ContactList(contact=[
+            Contact(
+                admin=False, number='0123 %06d' % i, id=i,
+                customer_id=i // 10, customer_name='Customer %d' % (i // 10),
+                name='Contact %d' % i, email='contact%d@example.com' % i,
+                create_date=START_DATE + datetime.timedelta(minutes=i),
+                entitlement_count=i % 5, ref1='REF%d' % i, status=True,
+                user_registered=bool(i % 2),
+            )
+            for i in range(count)
+        ]),
+    )
+
+
+def search_customers_response(count=1000):
+    """
+    Returns a SearchCustomersResponse with the given number of customers.
+    """
+    Customer = customers.SearchCustomersResponse.CustomerList.Customer
+
+    return customers.SearchCustomersResponse(
+        status='ok',
+        total=count,
+        customers=customers.SearchCustomersResponse.CustomerList(customer=[
+            Customer(
+                crm_id='CRM%d' % i, id=i, name='Customer %d' % i,
+                identifier='cust-%d' % i, description='A customer',
+                enabled=True, ref='REF%d' % i,
+            )
+            for i in range(count)
+        ]),
+    )
+
+
+# Name -> (class, function returning an instance)
+FIXTURES = {
+    'entitlement': (entitlements.Entitlement, entitlement),
+    'search_contacts': (contacts.SearchContactsResponse,
+                        search_contacts_response),
+    'search_customers': (customers.SearchCustomersResponse,
+                         search_customers_response),
+}
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Load test of ApiSession calls made through a BulkExecutor, measuring calls
+per second at each level of concurrency. Runs against a local fake EMS
+unless --url is given.
+
+    python -m benchmarks.load [--operation NAME] [--concurrency 1,8,32]
+
+With --adaptive, the calls are limited by an AdaptiveConcurrency of at most
+the number of threads, and with --rate to that many calls per second.
+"""
+
+import argparse
+import datetime
+import itertools
+import timeit
+
+import ems
+
+from ems import bulk
+from ems import limits
+
+from benchmarks import emit
+from benchmarks import fakeems
+
+
+def _get_contact_by_email(i):
+    return {'email': 'contact%d@example.com' % (i % 100)}
+
+
+def _get_customer_by_name(i):
+    return {'name': 'Customer %d' % (i % 10)}
+
+
+def _search_contacts(i):
+    return {'page_size': 100, 'page_index': i % 10 + 1}
+
+
+def _create_contact(i):
+    # Unique across runs against the same server
+    return {'email': 'load%d@example.com' % next(_CONTACTS),
+            'name': 'Load %d' % i}
+
+
+def _create_entitlement(i):
+    start = datetime.datetime(2016, 1, 1)
+
+    return {
+        'customer_id': 1, 'contact_id': 1, 'products': {'Product': '1.0'},
+        'start_date': start, 'end_date': start + datetime.timedelta(365),
+        'num_activations': 1,
+    }
+
+
+# Number of the next contact created
+_CONTACTS = itertools.count()
+
+# Operation -> function returning the keyword arguments of the ith call
+OPERATIONS = {
+    'get_contact_by_email': _get_contact_by_email,
+    'get_customer_by_name': _get_customer_by_name,
+    'search_contacts': _search_contacts,
+    'create_contact': _create_contact,
+    'create_entitlement': _create_entitlement,
+}
+
+
+def run(url, operations, concurrency, calls, adaptive=False, rate=None):
+    results = []
+
+    for op in operations:
+        for workers in concurrency:
+            limiter = None
+
+            if adaptive or rate:
+                limiter = limits.Limiter(
+                    rate=rate,
+                    concurrency=limits.AdaptiveConcurrency(
+                        initial=min(workers, limits.DEFAULT_INITIAL_LIMIT),
+                        max_limit=workers) if adaptive else None)
+
+            api = ems.ApiSession(url, 'admin', 'password',
+                                 pool_maxsize=workers, limiter=limiter)
+
+            args = [OPERATIONS[op](i) for i in range(calls)]
+            executor = bulk.BulkExecutor(api, max_workers=workers)
+
+            start = timeit.default_timer()
+            errors = {}
+
+            for result in executor.map(op, args, ordered=False):
+                if result.error is not None:
+                    code = getattr(result.error, 'code', None)
+                    errors[str(code)] = errors.get(str(code), 0) + 1
+
+            seconds = timeit.default_timer() - start
+
+            results.append({
+                'name': '%s.%d' % (op, workers),
+                'operation': op,
+                'concurrency': workers,
+                'calls': calls,
+                'seconds': seconds,
+                'calls_per_second': calls / seconds,
+                'errors': errors,
+                'pool': api.pool_stats(),
+                'limiter': limiter.stats() if limiter else None,
+            })
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--url', help='EMS to test. Default: a local fake')
+    parser.add_argument('--operation', action='append',
+                        choices=sorted(OPERATIONS),
+                        help='Operation to run; may be repeated. Default: all')
+    parser.add_argument('--concurrency', default='1,4,16,64',
+                        help='Comma separated numbers of threads')
+    parser.add_argument('--calls', type=int, default=1000,
+                        help='Number of calls made at each concurrency')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Seconds the local fake delays each response')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Fraction of calls the local fake fails')
+    parser.add_argument('--max-in-flight', type=int,
+                        help='Calls the local fake handles at once before '
+                             'failing with 107')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Adapt the number of calls in flight')
+    parser.add_argument('--rate', type=float,
+                        help='Limit the calls per second')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                        help='File to write the JSON results to')
+    args = parser.parse_args(argv)
+
+    url = args.url
+    server = None
+
+    if url is None:
+        server = fakeems.FakeEMS(
+            dataset=fakeems.Dataset(num_customers=100, num_contacts=1000),
+            latency=args.latency, error_rate=args.error_rate,
+            max_in_flight=args.max_in_flight)
+        server.start()
+        url = server.url
+
+    concurrency = [int(c) for c in args.concurrency.split(',')]
+    operations = args.operation or sorted(OPERATIONS)
+
+    try:
+        emit('load', run(url, operations, concurrency, args.calls,
+                         adaptive=args.adaptive, rate=args.rate),
+             out=args.output)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmark of validating and encoding the parameters of an API call,
+comparing the compiled parameters of _ApiCall with the previous
+implementation which looked up and dispatched on the schema of each
+parameter for every call.
+"""
+
+import six
+
+import ems
+
+from benchmarks import best_time
+from benchmarks import emit
+from ems import exceptions as exc
+
+
+# The schema of ApiSession.create_contact
+PARAMS = {
+    'emailId': {
+        'required': True
+    },
+    'localeId': {
+        'type': 'int',
+    },
+    'customerId': {
+        'type': 'int',
+    },
+    'loginAllowed': {
+        'type': 'bool',
+    },
+    'contactName': {},
+    'contactNumber': {},
+    'contactPassword': {},
+    'refId1': {},
+    'refId2': {},
+}
+
+KWDS = dict(
+    emailId=u'someone@example.com', localeId=None, customerId=1234,
+    contactName=u'Some One', contactNumber=u'01234 567890',
+    loginAllowed=True, contactPassword=None, refId1=u'ref', refId2=None
+)
+
+
+def legacy_build_parameters(call, kwds):
+    """
+    The parameter handling of _ApiCall.__call__ before the parameters were
+    compiled.
+    """
+    params = dict((k, dict(v, type=v.get('type', 'string')))
+                  for k, v in six.iteritems(call.params))
+    required_params = [k for k, v in six.iteritems(params)
+                       if v.get('required', False)]
+
+    def as_text(value):
+        if value is None:
+            return None
+
+        if isinstance(value, int):
+            return six.text_type(value)
+
+        if isinstance(value, six.string_types):
+            return six.text_type(value)
+
+        if isinstance(value, bool):
+            return six.text_type(value).lower()
+
+    def is_valid(type_, value):
+        if value is None:
+            return True
+
+        if type_ == 'bool':
+            return isinstance(value, bool)
+
+        if type_ == 'string':
+            return isinstance(value, six.string_types)
+
+        if type_ == 'int':
+            return isinstance(value, int)
+
+        return False
+
+    def build_parameters(kwds):
+        for param in required_params:
+            if kwds.get(param, None) is None:
+                raise exc.ValidationException(
+                    'Parameter %s is required' % param
+                )
+
+        parameters = {}
+
+        for k, v in six.iteritems(kwds):
+            if k not in params:
+                raise exc.ValidationException('Unknown parameter: %s' % k)
+
+            if not is_valid(params[k]['type'], v):
+                raise exc.ValidationException(
+                    'Parameter %s must be of type %s' %
+                    (k, params[k]['type'])
+                )
+
+            tag = params[k].get('param', k)
+            parameters[tag] = as_text(v)
+
+        return parameters
+
+    return build_parameters
+
+
+def main():
+    call = ems._ApiCall(session=None, url='createContact.xml',
+                        method='POST', params=PARAMS)
+    legacy = legacy_build_parameters(call, KWDS)
+
+    number = 20000
+    legacy_time = best_time(lambda: legacy(KWDS), number)
+    compiled_time = best_time(lambda: call.build_parameters(KWDS), number)
+
+    emit('params', [
+        {
+            'name': 'build_parameters.legacy',
+            'seconds_per_call': legacy_time,
+            'calls_per_second': 1 / legacy_time,
+        },
+        {
+            'name': 'build_parameters.compiled',
+            'seconds_per_call': compiled_time,
+            'calls_per_second': 1 / compiled_time,
+            'speedup': legacy_time / compiled_time,
+        },
+    ])
+
+
+if __name__ == '__main__':
+    main()
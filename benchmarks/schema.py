@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of the schema operations (from_text, parse, validate, to_element
+and render with each backend) on generated EMS payloads: a large
+Entitlement, a SearchContactsResponse with 10k contacts and a
+SearchCustomersResponse with 1k customers.
+
+    python -m benchmarks.schema [--fixture NAME] [--scale 0.1] [-o FILE]
+"""
+
+import argparse
+
+from lxml import etree
+
+from benchmarks import best_time
+from benchmarks import emit
+from benchmarks import fixtures
+from benchmarks import peak_memory
+
+
+# Default size of each fixture, as keyword arguments to its function
+SIZES = {
+    'entitlement': {'product_keys': 20},
+    'search_contacts': {'count': 10000},
+    'search_customers': {'count': 1000},
+}
+
+
+def operations(cls, obj, text):
+    """
+    Returns the name and function of each operation measured for an object
+    of the given class, and its rendered text.
+    """
+    root = etree.fromstring(text.encode('utf-8'))
+
+    return [
+        ('from_text', lambda: cls.from_text(text)),
+        ('parse', lambda: cls.parse(root)),
+        ('validate', obj.validate),
+        ('to_element', obj.to_element),
+        ('render', obj.render),
+        ('render_stream', lambda: obj.render(backend='stream')),
+    ]
+
+
+def run(names, scale, repeat):
+    results = []
+
+    for name in names:
+        cls, factory = fixtures.FIXTURES[name]
+
+        size = dict((k, max(int(v * scale), 1))
+                    for k, v in SIZES[name].items())
+
+        obj = factory(**size)
+        text = obj.render().decode('utf-8')
+        xml_bytes = len(text.encode('utf-8'))
+
+        for op, func in operations(cls, obj, text):
+            seconds = best_time(func, number=1, repeat=repeat)
+
+            results.append({
+                'name': '%s.%s' % (name, op),
+                'fixture': name,
+                'size': size,
+                'operation': op,
+                'xml_bytes': xml_bytes,
+                'seconds': seconds,
+                'megabytes_per_second': xml_bytes / seconds / 1e6,
+                'peak_traced_bytes': peak_memory(func),
+            })
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--fixture', action='append',
+                        choices=sorted(fixtures.FIXTURES),
+                        help='Fixture to run; may be repeated. Default: all')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiplier for the size of each fixture')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timed runs of each operation')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                        help='File to write the JSON results to')
+    args = parser.parse_args(argv)
+
+    names = args.fixture or sorted(fixtures.FIXTURES)
+    emit('schema', run(names, args.scale, args.repeat), out=args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,14 +18,27 @@
 Global EMS API
 """
 
+import functools
 import string
+import sys
+import threading
 
-import requests
 import six
 
+from lxml import etree
 from unidecode import unidecode
 
+from ems import bulk
 from ems import exceptions as exc
+from ems import flows
+from ems import limits
+from ems import metrics
+from ems import retry
+from ems import transport
+from ems import upsert
+
+from ems.schema import diff
+from ems.schema import table
 
 from ems.types import contacts
 from ems.types import customers
@@ -33,12 +46,261 @@ from ems.types import entitlements
 from ems.types import login
 from ems.types import errors
 
+try:
+    from time import monotonic
+except ImportError:
+    from monotonic import monotonic
+
 
 # API versioning for EMS API
 DEFAULT_HEADERS = {
     'Accept': 'application/vnd.ems.v12',
 }
 
+# Default number of results requested per page when paginating searches
+DEFAULT_PAGE_SIZE = 1000
+
+
+class _Prefetch(threading.Thread):
+    """
+    Runs a call in the background, holding on to its result (or exception)
+    until it is needed.
+    """
+    def __init__(self, func, **kwds):
+        super(_Prefetch, self).__init__()
+        self.daemon = True
+
+        self.func = func
+        self.kwds = kwds
+
+        self.value = None
+        self.exc_info = None
+
+        self.start()
+
+    def run(self):
+        try:
+            self.value = self.func(**self.kwds)
+        except Exception:
+            self.exc_info = sys.exc_info()
+
+    def result(self):
+        """
+        Waits for the call to finish and returns its value, re-raising any
+        exception raised by the call.
+        """
+        self.join()
+
+        if self.exc_info is not None:
+            six.reraise(*self.exc_info)
+
+        return self.value
+
+
+# Functions checking and encoding the values of each type of API parameter
+_PARAM_TYPES = {
+    'string': (lambda v: isinstance(v, six.string_types), six.text_type),
+    'int': (lambda v: isinstance(v, six.integer_types), six.text_type),
+    'bool': (lambda v: isinstance(v, bool),
+             lambda v: u'true' if v else u'false'),
+}
+
+# Marks a parameter which was not passed to a call
+_MISSING = object()
+
+# Errors given when the session's login has expired, after which the call is
+# made again once logged in, and their codes as given by the REST API
+_LOGIN_ERRORS = (exc.LoginRequiredException, exc.UnauthorizedException)
+_LOGIN_ERROR_CODES = frozenset(
+    str(e.error_code) for e in _LOGIN_ERRORS)
+
+
+class _Login(object):
+    """
+    Logs a session in, making sure that when many threads find the login
+    has expired at once only one of them logs in again.
+
+    Callers take the generation before making a call. If the call fails as
+    the login has expired, they pass it to renew, which only logs in if no
+    other thread has done so since.
+    """
+    def __init__(self, authenticate):
+        self.authenticate = authenticate
+        self.lock = threading.Lock()
+
+        # Number of times the session has logged in
+        self.generation = 0
+
+        # Time of the last login, or None
+        self.last_login = None
+
+    def renew(self, generation=None):
+        """
+        Logs in, unless the generation is given and another login has
+        happened since it was taken.
+        """
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self.authenticate()
+
+            self.generation += 1
+            self.last_login = monotonic()
+
+
+class _KeepAlive(threading.Thread):
+    """
+    Logs a session in again once interval seconds have passed since it last
+    logged in, so that calls don't wait for the login to be renewed when it
+    expires.
+    """
+    def __init__(self, login_, interval):
+        super(_KeepAlive, self).__init__()
+        self.daemon = True
+
+        self.login = login_
+        self.interval = interval
+        self.stopped = threading.Event()
+
+        # The exception raised by the last failed login, if any
+        self.error = None
+
+        self.start()
+
+    def run(self):
+        while True:
+            last_login = self.login.last_login or monotonic()
+            wait = max(last_login + self.interval - monotonic(), 0)
+
+            if self.stopped.wait(wait):
+                return
+
+            # Skip if the session logged in while waiting
+            if self.login.last_login != last_login:
+                continue
+
+            try:
+                self.login.renew()
+                self.error = None
+            except Exception as e:
+                # Calls will still log in again if the login expires, so
+                # keep trying.
+                self.error = e
+
+                if self.stopped.wait(self.interval):
+                    return
+
+    def stop(self):
+        self.stopped.set()
+
+
+def _error_code(response):
+    """
+    Returns the error code given by a response from the REST API, or None.
+    """
+    err_code = response.headers.get('errorCode', None)
+
+    # Header values are text, whereas the exceptions are keyed by number
+    if err_code is not None and err_code.isdigit():
+        err_code = int(err_code)
+
+    return err_code
+
+
+def _raise_for_response(response):
+    """
+    Raises the EMS exception for a failed response from the REST API, which
+    gives the error code in a header and the description as the body, or a
+    BadResponseException if it gives no error code.
+    """
+    err_code = _error_code(response)
+
+    if err_code is None:
+        raise exc.BadResponseException(response.status_code, response.text)
+
+    err_obj = errors.ErrorResponse(
+        code=err_code,
+        description=response.text,
+        status='FAIL'
+    )
+
+    raise exc.api_exception_factory(err_obj)
+
+
+def _customer_tags(response):
+    """
+    Cache tags for a CustomerDetailsResponse.
+    """
+    tags = [('customer', response.id)]
+
+    if response.contacts is not None:
+        for contact in response.contacts.contact or []:
+            tags.append(('contact', contact.id))
+
+    return tags
+
+
+def _contact_tags(response):
+    """
+    Cache tags for a ContactDetailsResponse.
+    """
+    tags = [('contact', response.id)]
+
+    if response.customer is not None:
+        tags.append(('customer', response.customer.id))
+
+    return tags
+
+
+def _association_tags(cache, kwds):
+    """
+    Cache tags to invalidate when a contact is associated with a customer:
+    the contact, its new customer and the customers it was cached with,
+    which include its previous customer.
+    """
+    contact = ('contact', kwds['contactId'])
+
+    tags = set(tag for tag in cache.related_tags(contact)
+               if tag[0] == 'customer')
+    tags.add(contact)
+    tags.add(('customer', kwds['customerId']))
+
+    return tags
+
+
+def _commit_entitlement(ent, start_date, end_date):
+    """
+    Marks a DRAFT entitlement to be committed, setting the dates of its
+    license models.
+    """
+    ent.action = 'COMMIT'
+    ent.lifecycle_stage = 'COMMITTED'
+
+    ent.license_model_index().update({
+        'START_DATE': start_date,
+        'END_DATE': end_date,
+    })
+
+
+def _page_items(response, path, page_index, page_size):
+    """
+    Returns the objects found at the given path of fields in a page of
+    search results, and whether it is the last page.
+    """
+    items = response
+    for name in path:
+        items = getattr(items, name, None)
+
+    items = items or []
+
+    if response.total is None:
+        last_page = len(items) < page_size
+    else:
+        last_page = page_index * page_size >= response.total
+
+    return items, last_page
+
 
 class _ApiCall(object):
     """
@@ -51,7 +313,7 @@ class _ApiCall(object):
         self.session = session
 
         # Parameters which may be sent to the resource
-        self.params = kwds.get('params', None)
+        self.params = kwds.get('params', None) or {}
 
         # Class returned by call for V1 api
         self.returns = kwds.get('returns', None)
@@ -62,43 +324,252 @@ class _ApiCall(object):
         # The HTTP method used for the call
         self.method = kwds.get('method', None)
 
+        # Collector of metrics.Samples of the calls, or None
+        self.metrics = kwds.get('metrics', None)
+
+        # The session's _Login, renewed when a call fails as the login has
+        # expired, or None
+        self.login = kwds.get('login', None)
+
+        # retry.RetryPolicy for failed calls, or None
+        self.retry = kwds.get('retry', None)
+
+        # limits.Limiter shared by the calls of the session, or None
+        self.limiter = kwds.get('limiter', None)
+
+        # Whether making the call twice has the same effect as making it once
+        self.idempotent = kwds.get('idempotent', True)
+
+        # Function given the parameters of a call which is not idempotent,
+        # returning the response it would have given if it has taken effect,
+        # or otherwise None. Allows the call to be retried.
+        self.check = kwds.get('check', None)
+
+        # Name of the call in its samples, by default the resource name
+        self.endpoint = kwds.get('endpoint', None) or \
+            self.url.rsplit('/', 1)[-1].split('.', 1)[0]
+
         # Class returned for errors
         self.err_returns = kwds.get('err_returns', errors.ErrorResponse)
 
+        # Cache of responses (cache.ResponseCache), or None
+        self.cache = kwds.get('cache', None)
+
+        # Function returning the cache tags for a response
+        self.cache_tags = kwds.get('cache_tags', None)
+
+        # Function returning the cache tags to invalidate given the keyword
+        # arguments of a call.
+        self.invalidates = kwds.get('invalidates', None)
+
         # A list of the parameters required for the call
         self.required_params = []
 
         # Saves a list of required parameters
         self.marshal_params()
 
+    @flows.flow
     def __call__(self, **kwds):
-        for param in self.required_params:
-            if kwds.get(param, None) is None:
-                raise exc.ValidationException(
-                    'Parameter %s is required' % param
-                )
+        parameters = self.build_parameters(kwds)
+
+        if self.cache is None:
+            yield self._do_request(parameters)
+            return
+
+        if self.invalidates is not None:
+            try:
+                yield self._do_request(parameters)
+                return
+            finally:
+                self.cache.invalidate(*self.invalidates(kwds))
+
+        key = self.cache_key(parameters)
+        ret = self.cache.get(key)
+
+        if ret is None:
+            ret = yield self._do_request(parameters)
+            tags = self.cache_tags(ret) if self.cache_tags else ()
+            self.cache.set(key, ret, tags)
+
+        yield ret
+
+    def cache_key(self, parameters):
+        """
+        Returns the key of the response to a call in the cache.
+        """
+        return (self.url, tuple(sorted(
+            (k, v) for k, v in six.iteritems(parameters) if v is not None
+        )))
+
+    def is_cached(self, kwds):
+        """
+        Returns whether the response to a call with the keyword arguments is
+        in the cache, so that making it sends no request.
+        """
+        if self.cache is None or self.invalidates is not None:
+            return False
+
+        return self.cache_key(self.build_parameters(kwds)) in self.cache
+
+    def stream(self, path, **kwds):
+        """
+        Makes the call and incrementally decodes the response as it is read
+        from the connection, yielding the objects found at the given path of
+        fields. See WebServiceObject.iterparse.
+
+        The call is retried and logged in again as _request does, as long as
+        it fails before the first object is yielded. Its Sample counts
+        reading the response as decoding, as the two are interleaved, and
+        its time includes the time taken to consume the objects.
+        """
+        parameters = self.build_parameters(kwds)
+
+        with metrics.measure(self.metrics, self.endpoint) as sample:
+            opened = self._do_request(
+                parameters, functools.partial(self._open_stream, path,
+                                              sample=sample))
+
+            for obj in self._read_stream(sample, *opened):
+                yield obj
+
+    @staticmethod
+    def _read_stream(sample, response, objs, obj):
+        """
+        Generator of the objects of a streamed call, given what _open_stream
+        returned, closing the response once they are consumed.
+        """
+        try:
+            while obj is not _MISSING:
+                yield obj
 
+                with sample.phase('decode'):
+                    obj = next(objs, _MISSING)
+        finally:
+            sample.bytes_received += response.raw.tell()
+            response.close()
+
+    @flows.flow
+    def _open_stream(self, path, parameters, timeout=None, sample=None):
+        """
+        Sends the request of a streamed call, returning the response, the
+        iterator of its objects and the first object (or _MISSING), which
+        is read so that errors are raised here.
+        """
+        args = self._encode(parameters, timeout, sample)
+        slot = yield self.session.acquire(self.limiter, self.endpoint)
+
+        with limits.observe(self.limiter, slot):
+            with sample.phase('network'):
+                response = yield self.session.request(stream=True, **args)
+                slot.done()
+
+            try:
+                self._check_status(response)
+
+                with sample.phase('decode'):
+                    response.raw.decode_content = True
+
+                    objs = self.returns.iterparse(response.raw, path,
+                                                  fallback=self.err_returns)
+
+                    try:
+                        obj = next(objs, _MISSING)
+                    except etree.XMLSyntaxError as e:
+                        raise exc.BadResponseException(response.status_code,
+                                                       str(e))
+
+                if isinstance(obj, self.err_returns):
+                    raise exc.api_exception_factory(obj)
+            except BaseException:
+                sample.bytes_received += response.raw.tell()
+                response.close()
+                raise
+
+            yield response, objs, obj
+
+    def table(self, path, **kwds):
+        """
+        Makes the call and decodes the objects found at the given path of
+        fields straight into a table.Table as the response is read.
+        """
+        parameters = self.build_parameters(kwds)
+        return self._do_request(parameters,
+                                functools.partial(self._table, path))
+
+    @flows.flow
+    def _table(self, path, parameters, timeout=None):
+        with metrics.measure(self.metrics, self.endpoint) as sample:
+            args = self._encode(parameters, timeout, sample)
+            slot = yield self.session.acquire(self.limiter, self.endpoint)
+
+            with limits.observe(self.limiter, slot):
+                with sample.phase('network'):
+                    response = yield self.session.request(stream=True,
+                                                          **args)
+                    slot.done()
+
+                try:
+                    self._check_status(response)
+
+                    with sample.phase('decode'):
+                        response.raw.decode_content = True
+
+                        try:
+                            ret = table.Table.from_file(
+                                self.returns, response.raw, path,
+                                fallback=self.err_returns)
+                        except etree.XMLSyntaxError as e:
+                            raise exc.BadResponseException(
+                                response.status_code, str(e))
+                finally:
+                    sample.bytes_received = response.raw.tell()
+                    response.close()
+
+                if isinstance(ret, self.err_returns):
+                    raise exc.api_exception_factory(ret)
+
+                yield ret
+
+    def build_parameters(self, kwds):
+        """
+        Validates the keyword arguments of a call and returns the parameters
+        to send to the resource.
+        """
         parameters = {}
 
-        for k, v in six.iteritems(kwds):
-            if k not in self.params:
-                raise exc.ValidationException('Unknown parameter: %s' % k)
+        # Number of the keyword arguments which are known parameters
+        found = 0
+
+        for name, tag, type_, required, check, encode in self.compiled_params:
+            value = kwds.get(name, _MISSING)
+
+            if value is _MISSING or value is None:
+                if required:
+                    raise exc.ValidationException(
+                        'Parameter %s is required' % name
+                    )
+
+                if value is None:
+                    found += 1
+
+                continue
+
+            found += 1
 
-            if not self.is_valid(self.params[k]['type'], v):
+            if not check(value):
                 raise exc.ValidationException(
-                    'Parameter %s must be of type %s' %
-                    (k, self.params[k]['type'])
+                    'Parameter %s must be of type %s' % (name, type_)
                 )
 
-            try:
-                tag = self.params[k].get('param', k)
-                parameters[tag] = self.as_text(v)
-            except ValueError as e:
-                raise exc.ValidationException(e.message)
+            parameters[tag] = encode(value)
+
+        if found != len(kwds):
+            unknown = sorted(k for k in kwds if k not in self.params)
+            raise exc.ValidationException('Unknown parameter: %s' % unknown[0])
 
-        return self._do_request(parameters)
+        return parameters
 
-    def _do_request(self, parameters):
+    def _request_args(self, parameters):
         # TODO: Add extra arguments for handling other things
         args = {
             'method': self.method,
@@ -110,87 +581,243 @@ class _ApiCall(object):
         else:
             args['data'] = parameters
 
-        response = self.session.request(**args)
+        return args
+
+    @flows.flow
+    def _with_login(self, func, *args):
+        """
+        Calls func, logging in again and calling it once more if it fails as
+        the login has expired.
+        """
+        if self.login is None:
+            yield func(*args)
+            return
+
+        generation = self.login.generation
+
+        try:
+            yield func(*args)
+        except _LOGIN_ERRORS:
+            yield self.login.renew(generation)
+            yield func(*args)
+
+    def _do_request(self, parameters, request=None):
+        """
+        Makes a call with request (by default _request), which is given the
+        parameters and a timeout, logging in again and retrying it as needed.
+        """
+        if request is None:
+            request = self._request
+
+        if self.retry is None:
+            return self._with_login(request, parameters)
+
+        check = None
+        if self.check is not None:
+            check = functools.partial(self.check, parameters)
+
+        return self.session.run(self.retry.steps(
+            functools.partial(self._with_login, request, parameters),
+            idempotent=self.idempotent, check=check,
+            sleep=self.session.sleep))
+
+    def _encode(self, parameters, timeout, sample):
+        """
+        Returns the arguments of the request for a call, limiting its timeout
+        to the seconds given by the retry policy, if any.
+        """
+        with sample.phase('encode'):
+            args = self._request_args(parameters)
+            sample.bytes_sent = metrics.body_size(args.get('data'))
+
+            if timeout is not None:
+                args['timeout'] = retry.limit_timeout(
+                    getattr(self.session, 'timeout', None), timeout)
+
+        return args
+
+    @flows.flow
+    def _request(self, parameters, timeout=None):
+        with metrics.measure(self.metrics, self.endpoint) as sample:
+            args = self._encode(parameters, timeout, sample)
+            slot = yield self.session.acquire(self.limiter, self.endpoint)
+
+            with limits.observe(self.limiter, slot):
+                with sample.phase('network'):
+                    response = yield self.session.request(**args)
+                    sample.bytes_received = len(response.content)
+                    slot.done()
+
+                with sample.phase('decode'):
+                    yield self._handle_response(response)
+
+    def _handle_response(self, response):
+        self._check_status(response)
 
-        # TODO handle response code not in ok codes
         try:
             ret = self.returns.from_text(response.text)
-        except exc.XMLException as e:
-            # TODO handle exception
-            ret = self.err_returns.from_text(response.text)
+        except exc.XMLException:
+            ret = self._parse_error(response)
+        except etree.XMLSyntaxError:
+            raise exc.BadResponseException(response.status_code,
+                                           response.text)
 
         if isinstance(ret, self.err_returns):
             raise exc.api_exception_factory(ret)
 
         return ret
 
+    def _check_status(self, response):
+        """
+        Raises the error for a response whose HTTP status is an error: the
+        EMS exception if its body is an EMS error, otherwise a
+        BadResponseException, such as for an error page from a proxy.
+        """
+        if response.status_code >= 400:
+            raise exc.api_exception_factory(self._parse_error(response))
+
+    def _parse_error(self, response):
+        """
+        Returns the EMS error in the body of a response, raising a
+        BadResponseException if it holds none.
+        """
+        try:
+            err = self.err_returns.from_text(response.text)
+        except (exc.XMLException, etree.XMLSyntaxError):
+            err = None
+
+        if err is None or err.code is None:
+            raise exc.BadResponseException(response.status_code,
+                                           response.text)
+
+        return err
+
     def marshal_params(self):
         """
-        Parses the parameters for the call.
+        Parses the parameters for the call, compiling each into a tuple of its
+        name, the name sent to the resource, its type, whether it is required
+        and the functions checking and encoding its values.
         """
-        if self.params is not None:
-            for k, v in six.iteritems(self.params):
-                if v.get('required', False):
-                    self.required_params.append(k)
+        compiled = []
 
-                if 'type' not in v:
-                    self.params[k]['type'] = 'string'
+        for k, v in six.iteritems(self.params):
+            type_ = v.get('type', 'string')
 
-                if 'param' not in v:
-                    self.params[k]['param'] = k
+            if type_ not in _PARAM_TYPES:
+                raise exc.SchemaException(
+                    'Unknown type %s for parameter %s' % (type_, k)
+                )
 
-    @staticmethod
-    def as_text(value):
-        if value is None:
-            return None
+            required = v.get('required', False)
+            if required:
+                self.required_params.append(k)
 
-        if isinstance(value, int):
-            return six.text_type(value)
+            check, encode = _PARAM_TYPES[type_]
+            compiled.append((k, v.get('param', k), type_, required, check,
+                             encode))
 
-        if isinstance(value, six.string_types):
-            return six.text_type(value)
+        self.compiled_params = tuple(compiled)
 
-        if isinstance(value, bool):
-            return six.text_type(value).lower()
 
-        raise exc.ValidationException(
-            'Unknown parameter type: %s' % type(value)
-        )
+class _BaseApiSession(object):
+    """
+    The calls of the EMS API, shared by ApiSession and
+    aio.AsyncApiSession. Calls taking more than one step are written as
+    flows (see flows), which the session's transport carries out.
+    """
 
-    @staticmethod
-    def is_valid(type_, value):
-        if value is None:
-            return True
+    # Class used for the calls made by the session
+    _call_class = _ApiCall
+
+    def _rest_request(self, idempotent=True, **kwds):
+        """
+        Makes a request of the REST API, retrying it as allowed by the retry
+        policy, if any.
+        """
+        if self.retry is None:
+            return self._login_request(None, **kwds)
 
-        if type_ == 'bool':
-            return isinstance(value, bool)
+        return self.session.run(self.retry.steps(
+            functools.partial(self._login_request, **kwds),
+            idempotent=idempotent, sleep=self.session.sleep))
 
-        if type_ == 'string':
-            return isinstance(value, six.string_types)
+    @flows.flow
+    def _login_request(self, timeout, **kwds):
+        """
+        Makes a request of the REST API, logging in again and making it once
+        more if it fails as the login has expired. Raises the EMS exception
+        for errors which the retry policy may retry, and a
+        BadResponseException for server errors giving no error code.
+        """
+        if timeout is not None:
+            kwds['timeout'] = retry.limit_timeout(self.session.timeout,
+                                                  timeout)
 
-        if type_ == 'int':
-            return isinstance(value, int)
+        generation = self._login.generation
+        response = yield self._limited_request(**kwds)
 
-        return False
+        if response.headers.get('errorCode', None) in _LOGIN_ERROR_CODES:
+            yield self._login.renew(generation)
+            response = yield self._limited_request(**kwds)
 
+        err_code = _error_code(response)
 
-class ApiSession(object):
+        if self.retry is not None and (
+                err_code in self.retry.codes or
+                err_code is None and response.status_code >= 500):
+            _raise_for_response(response)
 
-    def __init__(self, url, username, password):
-        # Session for storing cookies
-        self.session = requests.session()
-        self.session.headers.update(DEFAULT_HEADERS)
+        yield response
 
-        # Authentication credentials
-        self.username, self.password = username, password
+    @flows.flow
+    def _limited_request(self, endpoint=None, **kwds):
+        """
+        Makes a request of the REST API once the session's limiter allows.
+        endpoint names the call for the limiter.
+        """
+        slot = yield self.session.acquire(self.limiter, endpoint)
 
-        if url[-1] == '/':
-            self.baseurl = url
-        else:
-            self.baseurl = url + '/'
+        with limits.observe(self.limiter, slot):
+            response = yield self.session.request(**kwds)
+            slot.done()
 
-        # Log into the API
-        self.authenticate()
+            err_code = _error_code(response)
+            if err_code is not None:
+                slot.error = exc.EMSAPIException((err_code, response.text))
+            elif response.status_code >= 500:
+                slot.error = exc.BadResponseException(response.status_code,
+                                                      response.text)
+
+            yield response
+
+    @flows.flow
+    def _existing_contact(self, parameters):
+        """
+        Returns a CreateContactResponse for the contact being created with
+        the given parameters if it exists, otherwise None.
+        """
+        try:
+            contact = yield self.get_contact_by_email(parameters['emailId'])
+        except exc.NoSuchContactException:
+            yield None
+            return
+
+        yield contacts.CreateContactResponse(id=contact.id, status='ok')
+
+    @flows.flow
+    def _existing_customer(self, parameters):
+        """
+        Returns a CreateCustomerResponse for the customer being created with
+        the given parameters if it exists, otherwise None.
+        """
+        try:
+            customer = yield self.get_customer_by_name(
+                parameters['customerName'])
+        except exc.NoSuchCustomerException:
+            yield None
+            return
+
+        yield customers.CreateCustomerResponse(id=customer.id, status='ok')
 
     def new_url(self, path):
         if path[0] == '/':
@@ -201,8 +828,11 @@ class ApiSession(object):
     def authenticate(self):
 
         if not getattr(self, '_authenticate', None):
-            self._authenticate = _ApiCall(
+            self._authenticate = self._call_class(
                 session=self.session,
+                metrics=self.metrics,
+                retry=self.retry,
+                limiter=self.limiter,
                 url=self.new_url('verifyLogin.xml'),
                 method='POST',
                 returns=login.LoginResponse,
@@ -218,10 +848,16 @@ class ApiSession(object):
                        ref1=None, ref2=None):
 
         if not getattr(self, '_create_contact', None):
-            self._create_contact = _ApiCall(
+            self._create_contact = self._call_class(
                 session=self.session,
+                metrics=self.metrics,
+                retry=self.retry,
+                limiter=self.limiter,
+                login=self._login,
                 url=self.new_url('createContact.xml'),
                 method='POST',
+                idempotent=False,
+                check=self._existing_contact,
                 returns=contacts.CreateContactResponse,
                 params={
                     'emailId': {
@@ -256,10 +892,16 @@ class ApiSession(object):
                        login_allowed=True, locale=None, ref1=None, ref2=None):
 
         if not getattr(self, '_update_contact', None):
-            self._update_contact = _ApiCall(
+            self._update_contact = self._call_class(
                 session=self.session,
+                metrics=self.metrics,
+                retry=self.retry,
+                limiter=self.limiter,
+                login=self._login,
                 url=self.new_url('updateContact.xml'),
                 method='POST',
+                cache=self.cache,
+                invalidates=lambda kwds: [('contact', kwds['contactId'])],
                 returns=contacts.UpdateContactResponse,
                 params={
                     'contactId': {
@@ -281,8 +923,8 @@ class ApiSession(object):
                     'refId2': {},
                 })
 
-            if name:
-                name = unidecode(name)
+        if name:
+            name = unidecode(name)
 
         return self._update_contact(
             contactId=id, emailId=email, localeId=locale, contactName=name,
@@ -293,10 +935,16 @@ class ApiSession(object):
     def associate_contact(self, contact_id, customer_id):
 
         if not getattr(self, '_associate_contact', None):
-            self._associate_contact = _ApiCall(
+            self._associate_contact = self._call_class(
                 session=self.session,
+                metrics=self.metrics,
+                retry=self.retry,
+                limiter=self.limiter,
+                login=self._login,
                 url=self.new_url('associateContactWithCustomer.xml'),
                 method='POST',
+                cache=self.cache,
+                invalidates=lambda kwds: _association_tags(self.cache, kwds),
                 returns=contacts.AssociateContactResponse,
                 params={
                     'contactId': {
@@ -312,11 +960,23 @@ class ApiSession(object):
         return self._associate_contact(contactId=contact_id,
                                        customerId=customer_id)
 
-    def search_contacts(self, email=None, customer=None, ref1=None, ref2=None):
+    def search_contacts(self, email=None, customer=None, ref1=None, ref2=None,
+                        stream=False, page_size=10000, page_index=None,
+                        columnar=False):
+        """
+        Searches for contacts. If stream is True, returns a generator of the
+        SearchContactsResponse.ContactList.Contact objects, decoded one at a
+        time as the response is read. If columnar is True, returns a
+        table.Table of the contacts.
+        """
 
         if not getattr(self, '_search_contacts', None):
-            self._search_contacts = _ApiCall(
+            self._search_contacts = self._call_class(
                 session=self.session,
+                metrics=self.metrics,
+                retry=self.retry,
+                limiter=self.limiter,
+                login=self._login,
                 url=self.new_url('searchContacts.xml'),
                 method='POST',
                 returns=contacts.SearchContactsResponse,
@@ -337,18 +997,45 @@ class ApiSession(object):
                     'refId2': {},
                 })
 
-        return self._search_contacts(
+        params = dict(
             customerId=customer, emailId=email, refId1=ref1, refId2=ref2,
-            pageSize=10000
+            pageSize=page_size, pageIndex=page_index
+        )
+
+        if columnar:
+            return self._search_contacts.table(('contacts', 'contact'),
+                                               **params)
+
+        if stream:
+            return self._search_contacts.stream(('contacts', 'contact'),
+                                                **params)
+
+        return self._search_contacts(**params)
+
+    def iter_contacts(self, email=None, customer=None, ref1=None, ref2=None,
+                      page_size=DEFAULT_PAGE_SIZE, prefetch=False):
+        """
+        Generator of all the SearchContactsResponse.ContactList.Contact
+        objects matching a search, requesting one page at a time.
+        """
+        return self._iter_pages(
+            self.search_contacts, ('contacts', 'contact'), page_size,
+            prefetch, email=email, customer=customer, ref1=ref1, ref2=ref2
         )
 
     def get_contact_by_email(self, email):
 
         if not getattr(self, '_get_contact_by_email', None):
-            self._get_contact_by_email = _ApiCall(
+            self._get_contact_by_email = self._call_class(
                 session=self.session,
+                metrics=self.metrics,
+                retry=self.retry,
+                limiter=self.limiter,
+                login=self._login,
                 url=self.new_url('getContactByEmailId.xml'),
                 method='GET',
+                cache=self.cache,
+                cache_tags=_contact_tags,
                 returns=contacts.ContactDetailsResponse,
                 params={
                     'emailId': {
@@ -361,10 +1048,16 @@ class ApiSession(object):
     def create_customer(self, name, enabled=True, crm_id=None, ref=None):
 
         if not getattr(self, '_create_customer', None):
-            self._create_customer = _ApiCall(
+            self._create_customer = self._call_class(
                 session=self.session,
+                metrics=self.metrics,
+                retry=self.retry,
+                limiter=self.limiter,
+                login=self._login,
                 url=self.new_url('createCustomer.xml'),
                 method='POST',
+                idempotent=False,
+                check=self._existing_customer,
                 returns=customers.CreateCustomerResponse,
                 params={
                     'customerName': {
@@ -387,10 +1080,16 @@ class ApiSession(object):
     def get_customer_by_name(self, name):
 
         if not getattr(self, '_get_customer_by_name', None):
-            self._get_customer_by_name = _ApiCall(
+            self._get_customer_by_name = self._call_class(
                 session=self.session,
+                metrics=self.metrics,
+                retry=self.retry,
+                limiter=self.limiter,
+                login=self._login,
                 url=self.new_url('getCustomerByCustomerName.xml'),
                 method='GET',
+                cache=self.cache,
+                cache_tags=_customer_tags,
                 returns=customers.CustomerDetailsResponse,
                 params={'customerName': {'required': True}}
             )
@@ -401,10 +1100,16 @@ class ApiSession(object):
                         ref=None):
 
         if not getattr(self, '_update_customer', None):
-            self._update_customer = _ApiCall(
+            self._update_customer = self._call_class(
                 session=self.session,
+                metrics=self.metrics,
+                retry=self.retry,
+                limiter=self.limiter,
+                login=self._login,
                 url=self.new_url('updateCustomer.xml'),
                 method='POST',
+                cache=self.cache,
+                invalidates=lambda kwds: [('customer', kwds['customerId'])],
                 returns=customers.UpdateCustomerResponse,
                 params={
                     'customerId': {
@@ -426,20 +1131,32 @@ class ApiSession(object):
             refId=ref, custIdentifier=None, description=None
         )
 
-    def search_customers(self, name=None, crm_id=None, ref=None):
+    def search_customers(self, name=None, crm_id=None, ref=None,
+                         stream=False, page_size=1000, page_index=None,
+                         columnar=False):
+        """
+        Searches for customers. If stream is True, returns a generator of the
+        SearchCustomersResponse.CustomerList.Customer objects, decoded one at
+        a time as the response is read. If columnar is True, returns a
+        table.Table of the customers.
+        """
 
         if not getattr(self, '_search_customers', None):
-            self._search_customers = _ApiCall(
+            self._search_customers = self._call_class(
                 session=self.session,
+                metrics=self.metrics,
+                retry=self.retry,
+                limiter=self.limiter,
+                login=self._login,
                 url=self.new_url('searchCustomers.xml'),
                 method='GET',
-                returns=contacts.SearchCustomersResponse,
+                returns=customers.SearchCustomersResponse,
                 params={
                     'pageIndex': {
                         'type': 'int',
                     },
                     'pageSize': {
-                        'type': 'int,'
+                        'type': 'int',
                     },
                     'customerName': {},
                     'crmId': {},
@@ -449,113 +1166,506 @@ class ApiSession(object):
                     'searchPattern': {}
                 })
 
-        return self._search_customers(
-            customerName=name, crmId=crm_id, refId=ref, pageSize=1000
+        params = dict(
+            customerName=name, crmId=crm_id, refId=ref, pageSize=page_size,
+            pageIndex=page_index
+        )
+
+        if columnar:
+            return self._search_customers.table(('customers', 'customer'),
+                                                **params)
+
+        if stream:
+            return self._search_customers.stream(('customers', 'customer'),
+                                                 **params)
+
+        return self._search_customers(**params)
+
+    def iter_customers(self, name=None, crm_id=None, ref=None,
+                       page_size=DEFAULT_PAGE_SIZE, prefetch=False):
+        """
+        Generator of all the SearchCustomersResponse.CustomerList.Customer
+        objects matching a search, requesting one page at a time.
+        """
+        return self._iter_pages(
+            self.search_customers, ('customers', 'customer'), page_size,
+            prefetch, name=name, crm_id=crm_id, ref=ref
         )
 
+    def _is_cached(self, call, **kwds):
+        """
+        Returns whether the response to a call of the session, named by the
+        attribute holding it, is cached.
+        """
+        call = getattr(self, call, None)
+        return call is not None and call.is_cached(kwds)
+
+    @flows.flow
+    def upsert_customer(self, name, enabled=None, crm_id=None, ref=None,
+                        existing=None):
+        """
+        Creates a customer, or updates it if its fields differ from those
+        given, returning an upsert.UpsertResult. Fields given as None are left
+        as they are.
+
+        existing is the current state of the customer if known, such as a
+        customer found by search_customers, or upsert.ABSENT if it is known
+        not to exist. Otherwise it is fetched by name, from the cache if the
+        session has one. If another client creates the customer first, it is
+        fetched and updated instead.
+        """
+        values = {'enabled': enabled, 'crm_id': crm_id, 'ref': ref}
+        calls = 0
+
+        if existing is None:
+            if not self._is_cached('_get_customer_by_name',
+                                   customerName=name):
+                calls += 1
+
+            try:
+                existing = yield self.get_customer_by_name(name)
+            except exc.NoSuchCustomerException:
+                existing = upsert.ABSENT
+
+        if existing is upsert.ABSENT:
+            calls += 1
+
+            try:
+                response = yield self.create_customer(
+                    name, **upsert.given(values))
+            except exc.CustomerAlreadyExistsException:
+                calls += 1
+                existing = yield self.get_customer_by_name(name)
+            else:
+                yield upsert.UpsertResult(response.id, upsert.CREATED, calls,
+                                          2 - calls)
+                return
+
+        if not upsert.changed(existing, values):
+            yield upsert.UpsertResult(existing.id, upsert.UNCHANGED, calls,
+                                      1 - calls)
+            return
+
+        yield self.update_customer(existing.id, name=name, **values)
+        calls += 1
+
+        yield upsert.UpsertResult(existing.id, upsert.UPDATED, calls,
+                                  2 - calls)
+
+    @flows.flow
+    def upsert_contact(self, email, name=None, number=None, customer=None,
+                       locale=None, login_allowed=None, ref1=None, ref2=None,
+                       password=None, existing=None):
+        """
+        Creates a contact, or updates it if its fields differ from those given
+        and associates it with the customer if it has another, returning an
+        upsert.UpsertResult. Fields given as None are left as they are, and
+        the password is only set for a new contact.
+
+        existing is the current state of the contact if known, such as a
+        contact found by search_contacts, or upsert.ABSENT if it is known not
+        to exist. Otherwise it is fetched by email address, from the cache if
+        the session has one. A new contact is created with its customer,
+        rather than associated with it by another call. If another client
+        creates the contact first, it is fetched and updated instead.
+        """
+        if name:
+            name = unidecode(name)
+
+        values = {'name': name, 'number': number, 'locale': locale,
+                  'login_allowed': login_allowed, 'ref1': ref1, 'ref2': ref2}
+        calls = 0
+
+        if existing is None:
+            if not self._is_cached('_get_contact_by_email', emailId=email):
+                calls += 1
+
+            try:
+                existing = yield self.get_contact_by_email(email)
+            except exc.NoSuchContactException:
+                existing = upsert.ABSENT
+
+        if existing is upsert.ABSENT:
+            calls += 1
+
+            try:
+                response = yield self.create_contact(
+                    email, customer=customer, password=password,
+                    **upsert.given(values))
+            except exc.DuplicateEmailAddressException:
+                calls += 1
+                existing = yield self.get_contact_by_email(email)
+            else:
+                yield upsert.UpsertResult(
+                    response.id, upsert.CREATED, calls,
+                    2 + (customer is not None) - calls)
+                return
+
+        changes = upsert.changed(existing, values)
+        associate = customer is not None and \
+            not upsert.same(upsert.contact_customer(existing), customer)
+
+        if changes:
+            yield self.update_contact(existing.id, email, **values)
+            calls += 1
+
+        if associate:
+            yield self.associate_contact(existing.id, customer)
+            calls += 1
+
+        if not changes and not associate:
+            yield upsert.UpsertResult(existing.id, upsert.UNCHANGED, calls,
+                                      1 - calls)
+            return
+
+        yield upsert.UpsertResult(existing.id, upsert.UPDATED, calls,
+                                  1 + bool(changes) + associate - calls)
+
+    @flows.flow
     def create_entitlement(self, customer_id, contact_id, products, start_date,
                            end_date, num_activations, cc_email=None, ref1=None,
-                           ref2=None, user_registration='OPTIONAL'):
+                           ref2=None, user_registration='OPTIONAL', draft=True,
+                           fetch=True):
+        """
+        Creates an entitlement for the given products, a dict of product names
+        to versions, returning the committed Entitlement.
 
-        ent = entitlements.Entitlement.create(
-            customer_id=customer_id, contact_id=contact_id, products=products,
-            start_date=start_date, end_date=end_date,
-            num_activations=num_activations, cc_email=cc_email, ref1=ref1,
-            ref2=ref2, user_registration=user_registration
-        )
+        By default the entitlement is created as a DRAFT, fetched to set the
+        dates of its license models and then committed, taking three requests.
+        If draft is False, it is created as COMMITTED with a single request,
+        leaving the license model attributes at the defaults of the products.
 
-        response = self.session.request(
-            url=self.new_url('v4_0/ws/entitlement.ws'),
-            method='PUT',
-            data=ent.render(),
-        )
+        If fetch is False, the id of the entitlement is returned instead, which
+        saves decoding the response to the commit (or, if draft is False, the
+        request to fetch the entitlement).
+        """
+        with metrics.measure(self.metrics, 'create_entitlement') as sample:
+            with sample.phase('encode'):
+                ent = entitlements.Entitlement.create(
+                    customer_id=customer_id, contact_id=contact_id,
+                    products=products, start_date=start_date,
+                    end_date=end_date, num_activations=num_activations,
+                    cc_email=cc_email, ref1=ref1, ref2=ref2,
+                    user_registration=user_registration,
+                    lifecycle_stage='DRAFT' if draft else 'COMMITTED'
+                )
 
-        if response.status_code != 201:
-            err_code = response.headers.get('errorCode', None)
-            err = response.text
+            ent_id = yield self._put_entitlement(ent, parent=sample)
 
-            err_obj = errors.ErrorResponse(
-                code=err_code,
-                description=err,
-                status='FAIL'
-            )
+            if draft:
+                ent = yield self._get_entitlement(ent_id, parent=sample)
 
-            raise exc.api_exception_factory(err_obj)
+                with sample.phase('encode'):
+                    _commit_entitlement(ent, start_date, end_date)
 
-        ent_id = response.headers.get('Location', None)
+                ent = yield self._update_entitlement(ent_id, ent,
+                                                     parse=fetch,
+                                                     parent=sample)
 
-        ent = self.get_entitlement(ent_id)
+            elif fetch:
+                ent = yield self._get_entitlement(ent_id, parent=sample)
 
-        ent.action = 'COMMIT'
-        ent.lifecycle_stage = 'COMMITTED'
+        yield ent if fetch else ent_id
 
-        for a in ent.product_key:
-            for b in a.item:
-                for c in b.product:
-                    for d in c.feature:
-                        for e in d.license_model:
-                            for f in e.attribute:
-                                if f.name == 'START_DATE':
-                                    f.value = start_date
+    @flows.flow
+    def _put_entitlement(self, ent, parent=None):
+        """
+        Creates a new entitlement, returning its id. The phases of the request
+        are added to the parent metrics.Sample, if given.
+        """
+        with metrics.measure(self.metrics, 'put_entitlement',
+                             parent) as sample:
+            with sample.phase('encode'):
+                data = ent.render()
+                sample.bytes_sent = len(data)
+
+            with sample.phase('network'):
+                response = yield self._rest_request(
+                    idempotent=False,
+                    endpoint='put_entitlement',
+                    url=self.new_url('v4_0/ws/entitlement.ws'),
+                    method='PUT',
+                    data=data,
+                )
+                sample.bytes_received = len(response.content)
+
+            if response.status_code != 201:
+                _raise_for_response(response)
 
-                                if f.name == 'END_DATE':
-                                    f.value = end_date
+            yield response.headers.get('Location', None)
 
-        return self.update_entitlement(ent_id, ent)
+    def get_entitlement(self, entitlement_id, is_eid=False, lazy=False):
+        """
+        Returns an Entitlement. If lazy is True, its fields are only decoded
+        as they are read, which is quicker when only a few are needed.
+        """
+        return self._get_entitlement(entitlement_id, is_eid=is_eid,
+                                     lazy=lazy)
 
-    def get_entitlement(self, entitlement_id, is_eid=False):
+    @flows.flow
+    def _get_entitlement(self, entitlement_id, is_eid=False, lazy=False,
+                         parent=None):
         params = {}
         if is_eid:
             params['idType'] = 'Eid'
         else:
             params['idType'] = 'Entid'
 
-        response = self.session.request(
-            url=self.new_url('v4_0/ws/entitlement/%s.ws' % entitlement_id),
-            method='GET',
-            params=params
-        )
+        with metrics.measure(self.metrics, 'get_entitlement',
+                             parent) as sample:
+            with sample.phase('network'):
+                response = yield self._rest_request(
+                    endpoint='get_entitlement',
+                    url=self.new_url(
+                        'v4_0/ws/entitlement/%s.ws' % entitlement_id),
+                    method='GET',
+                    params=params
+                )
+                sample.bytes_received = len(response.content)
 
-        if response.status_code == 200:
-            return entitlements.Entitlement.from_text(response.text)
+            if response.status_code != 200:
+                _raise_for_response(response)
 
-        else:
-            err_code = response.headers.get('errorCode', None)
-            err = response.text
-            err_obj = errors.ErrorResponse(
-                code=err_code,
-                description=err,
-                status='FAIL',
-            )
+            with sample.phase('decode'):
+                yield entitlements.Entitlement.from_text(response.text,
+                                                         lazy=lazy)
 
-            raise exc.api_exception_factory(err_obj)
+    def update_entitlement(self, ent_id, entitlement, parse=True,
+                           original=None):
+        """
+        Updates an entitlement, returning the updated Entitlement sent back by
+        EMS, or None if parse is False.
 
-        return response.text
+        If original is given, e.g. a copy() of the entitlement taken when it
+        was fetched, the update is skipped when nothing differs from it, the
+        given entitlement being returned as is. The EMS endpoint replaces the
+        whole entitlement, so changed entitlements are sent in full.
+        """
+        return self._update_entitlement(ent_id, entitlement, parse=parse,
+                                        original=original)
 
-    def update_entitlement(self, ent_id, entitlement):
+    @flows.flow
+    def _update_entitlement(self, ent_id, entitlement, parse=True,
+                            original=None, parent=None):
+        if original is not None and not diff.diff(original, entitlement):
+            yield entitlement if parse else None
+            return
 
         # Fix ridiculous error from EMS
         if entitlement.cc_email is None:
             entitlement.cc_email = ''
 
-        response = self.session.request(
-            url=self.new_url('v4_0/ws/entitlement/%s.ws' % ent_id),
-            method='POST',
-            data=entitlement.render(),
-        )
+        with metrics.measure(self.metrics, 'update_entitlement',
+                             parent) as sample:
+            with sample.phase('encode'):
+                data = entitlement.render()
+                sample.bytes_sent = len(data)
+
+            with sample.phase('network'):
+                response = yield self._rest_request(
+                    endpoint='update_entitlement',
+                    url=self.new_url('v4_0/ws/entitlement/%s.ws' % ent_id),
+                    method='POST',
+                    data=data,
+                )
+                sample.bytes_received = len(response.content)
+
+            if response.status_code != 200:
+                _raise_for_response(response)
+
+            if not parse:
+                yield None
+                return
+
+            with sample.phase('decode'):
+                yield entitlements.Entitlement.from_text(response.text)
 
-        if response.status_code == 200:
-            return entitlements.Entitlement.from_text(response.text)
 
+class ApiSession(_BaseApiSession):
+    """
+    A session of the EMS API, whose calls block until they finish.
+    """
+
+    def __init__(self, url, username, password, timeout=None,
+                 pool_connections=transport.DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=transport.DEFAULT_POOL_MAXSIZE,
+                 pool_block=False, max_retries=0, adapter=None, cache=None,
+                 metrics=None, keep_alive=None, retry=None, limiter=None):
+        """
+        timeout is the default for requests, in seconds or as a (connect,
+        read) tuple. The pool arguments set the number of per-host connection
+        pools, the connections kept open per host and whether to wait for a
+        free connection rather than open a new one when all are in use.
+        max_retries is passed to the adapter for retrying failed connections.
+
+        Alternatively, any requests transport adapter may be given, in which
+        case the pool arguments are ignored.
+
+        If a cache.ResponseCache is given, customers and contacts fetched by
+        name or email are cached, and invalidated when updated through this
+        session.
+
+        If a collector of metrics, such as a metrics.HistogramCollector, is
+        given, it is passed a metrics.Sample of each call made.
+
+        Calls failing as the login has expired log in again and are retried
+        once. If keep_alive is given, the session logs in again in the
+        background every keep_alive seconds, which should be less than the
+        time EMS keeps a login, until close() is called.
+
+        If a retry.RetryPolicy is given, calls failing with transient errors
+        are made again as it allows. Creating a contact or customer is only
+        retried after checking that it was not created, and creating an
+        entitlement only if the request was never sent.
+
+        If a limits.Limiter is given, all calls of the session wait until it
+        allows them, limiting their rate and number in flight.
+        """
+        # Cache of responses, or None
+        self.cache = cache
+
+        # retry.RetryPolicy for failed calls, or None
+        self.retry = retry
+
+        # limits.Limiter of the session's calls, or None
+        self.limiter = limiter
+
+        # Collector of metrics.Samples, or None
+        self.metrics = metrics
+
+        # Session for storing cookies
+        self.session = transport.Session(timeout=timeout)
+        self.session.headers.update(DEFAULT_HEADERS)
+
+        if adapter is None:
+            adapter = transport.HTTPAdapter(pool_connections=pool_connections,
+                                            pool_maxsize=pool_maxsize,
+                                            pool_block=pool_block,
+                                            max_retries=max_retries)
+
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # Authentication credentials
+        self.username, self.password = username, password
+
+        if url[-1] == '/':
+            self.baseurl = url
         else:
-            err_code = response.headers.get('errorCode', None)
-            err = response.text
-            err_obj = errors.ErrorResponse(
-                code=err_code,
-                description=err,
-                status='FAIL'
-            )
+            self.baseurl = url + '/'
+
+        # Log into the API
+        self._login = _Login(self.authenticate)
+        self._login.renew()
+
+        # Thread renewing the login, or None
+        self._keep_alive = None
+
+        if keep_alive:
+            self._keep_alive = _KeepAlive(self._login, keep_alive)
+
+    def close(self):
+        """
+        Stops renewing the login and closes the session's connections.
+        """
+        if self._keep_alive is not None:
+            self._keep_alive.stop()
+            self._keep_alive = None
+
+        self.session.close()
+
+    def pool_stats(self):
+        """
+        Returns the connection pool statistics of the session's adapter. See
+        transport.HTTPAdapter.pool_stats. Returns None if the adapter does not
+        keep statistics.
+        """
+        adapter = self.session.get_adapter(self.baseurl)
+        pool_stats = getattr(adapter, 'pool_stats', None)
+
+        if pool_stats is None:
+            return None
+
+        return pool_stats()
+
+    def _iter_pages(self, search, path, page_size, prefetch, **kwds):
+        """
+        Generator walking the pages of a search method, yielding the objects
+        found at the given path of fields in each response. Pages are
+        requested until the total given by the responses is reached or a
+        short page is returned. If prefetch is True, the next page is
+        requested in the background while the current one is consumed.
+        """
+        page_index = 1
+        response = search(page_index=page_index, page_size=page_size, **kwds)
+
+        while response is not None:
+            items, last_page = _page_items(response, path, page_index,
+                                           page_size)
+            response = None
+            next_page = None
+
+            if items and not last_page:
+                page_index += 1
+
+                if prefetch:
+                    next_page = _Prefetch(search, page_index=page_index,
+                                          page_size=page_size, **kwds)
+
+            for item in items:
+                yield item
+
+            if next_page is not None:
+                response = next_page.result()
+            elif items and not last_page:
+                response = search(page_index=page_index, page_size=page_size,
+                                  **kwds)
+
+    def upsert_customers(self, items, max_workers=None, prefetch=None,
+                         ordered=True):
+        """
+        Upserts many customers, running the upserts for different customers
+        at the same time. items is an iterable of dicts of the keyword
+        arguments to upsert_customer.
+
+        Returns an upsert.BulkUpsert, which yields a bulk.BulkResult for each
+        customer as it is iterated over and holds the totals of calls made
+        and saved in its stats. See it for when customers are prefetched.
+        """
+        if max_workers is None:
+            max_workers = bulk.DEFAULT_MAX_WORKERS
+
+        return upsert.BulkUpsert(self, 'customer', items,
+                                 max_workers=max_workers, prefetch=prefetch,
+                                 ordered=ordered)
+
+    def upsert_contacts(self, items, max_workers=None, prefetch=None,
+                        ordered=True):
+        """
+        Upserts many contacts, as upsert_customers does customers.
+        """
+        if max_workers is None:
+            max_workers = bulk.DEFAULT_MAX_WORKERS
+
+        return upsert.BulkUpsert(self, 'contact', items,
+                                 max_workers=max_workers, prefetch=prefetch,
+                                 ordered=ordered)
+
+    def create_entitlements(self, items, max_workers=None, journal=None,
+                            fetch=True, ordered=True):
+        """
+        Creates many entitlements, running the requests of create_entitlement
+        for different entitlements at the same time. items is an iterable of
+        dicts of the keyword arguments to create_entitlement.
+
+        Returns a generator of a bulk.BulkResult for each entitlement. See
+        bulk.EntitlementPipeline for how progress is kept in the journal file
+        so an interrupted run can be resumed.
+        """
+        if max_workers is None:
+            max_workers = bulk.DEFAULT_MAX_WORKERS
 
-            raise exc.api_exception_factory(err_obj)
+        pipeline = bulk.EntitlementPipeline(self, max_workers=max_workers,
+                                            journal=journal, fetch=fetch)
 
-        return response.text
+        return pipeline.run(items, ordered=ordered)
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Asyncio EMS API
+
+Requires Python 3 and aiohttp.
+"""
+
+import asyncio
+import functools
+import inspect
+import io
+
+import aiohttp
+import six
+
+import ems
+
+from ems import limits
+from ems import metrics
+from ems import retry
+
+
+# Default number of requests allowed in flight at once
+DEFAULT_MAX_CONCURRENCY = 100
+
+retry.register_errors(unsent=(aiohttp.ClientConnectorError,),
+                      network=(aiohttp.ClientConnectionError,
+                               asyncio.TimeoutError))
+
+
+async def _run(flow):
+    """
+    Runs a flow (see ems.flows), awaiting the steps which return awaitables,
+    and returns its result.
+    """
+    value, error = None, None
+
+    while True:
+        try:
+            if error is None:
+                value = flow.send(value)
+            else:
+                value = flow.throw(error)
+        except StopIteration:
+            return value
+
+        error = None
+
+        if inspect.isawaitable(value):
+            try:
+                value = await value
+            except BaseException as e:
+                value, error = None, e
+
+
+class _AsyncLogin(object):
+    """
+    Logs an AsyncApiSession in, making sure that when many calls find the
+    login has expired at once only one of them logs in again. See
+    ems._Login.
+    """
+    def __init__(self, authenticate):
+        self.authenticate = authenticate
+        self.lock = asyncio.Lock()
+
+        # Number of times the session has logged in
+        self.generation = 0
+
+        # Time of the last login, or None
+        self.last_login = None
+
+    async def renew(self, generation=None):
+        async with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            await self.authenticate()
+
+            self.generation += 1
+            self.last_login = ems.monotonic()
+
+
+async def _keep_alive(login_, interval):
+    """
+    Logs a session in again once interval seconds have passed since it last
+    logged in, until cancelled. See ems._KeepAlive.
+    """
+    while True:
+        last_login = login_.last_login or ems.monotonic()
+        await asyncio.sleep(max(last_login + interval - ems.monotonic(), 0))
+
+        # Skip if the session logged in while waiting
+        if login_.last_login != last_login:
+            continue
+
+        try:
+            await login_.renew()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Calls will still log in again if the login expires
+            await asyncio.sleep(interval)
+
+
+class _AsyncResponse(object):
+    """
+    The parts of an aiohttp response used by the API. These are read before
+    the connection is released so the response can be handled in the same way
+    as a requests response. raw reads the body from memory.
+    """
+    def __init__(self, status_code, headers, content, text):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.text = text
+        self.raw = io.BytesIO(content)
+
+    def close(self):
+        self.raw.close()
+
+
+class _AsyncTransport(object):
+    """
+    Sends the requests for an AsyncApiSession, limiting the number of requests
+    in flight, and carries out the other steps of its calls which wait. See
+    transport.Session.
+    """
+
+    # Waits between retries
+    sleep = staticmethod(asyncio.sleep)
+
+    # Runs the flow of a call, returning a coroutine
+    run = staticmethod(_run)
+
+    # Default timeout of requests, in seconds
+    timeout = None
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+        # Set as calls limited by a limits.Limiter finish
+        self.ready = asyncio.Event()
+
+        # Counts of how connections were taken for requests. See
+        # transport.HTTPAdapter.pool_stats.
+        self.stats = dict.fromkeys(
+            ('requests', 'hits', 'new_connections', 'waits'), 0)
+
+        # The aiohttp session must be created within the event loop, so it is
+        # only created when the first request is made.
+        self.client = None
+
+    @staticmethod
+    def _strip(values):
+        # aiohttp does not skip parameters which are None, unlike requests
+        if isinstance(values, dict):
+            return dict((k, v) for k, v in six.iteritems(values)
+                        if v is not None)
+
+        return values
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        for signal, key in ((trace.on_connection_create_end,
+                             'new_connections'),
+                            (trace.on_connection_reuseconn, 'hits'),
+                            (trace.on_connection_queued_start, 'waits')):
+            signal.append(functools.partial(self._count, key))
+
+        return trace
+
+    async def _count(self, key, session, context, params):
+        self.stats[key] += 1
+
+        if key != 'waits':
+            self.stats['requests'] += 1
+
+    def pool_stats(self):
+        return dict(self.stats)
+
+    async def request(self, method, url, params=None, data=None,
+                      timeout=None, stream=False):
+        """
+        Sends a request, returning an _AsyncResponse. The response is always
+        read in full, even when stream is True.
+        """
+        if self.client is None:
+            self.client = aiohttp.ClientSession(
+                headers=ems.DEFAULT_HEADERS,
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                trace_configs=[self._trace_config()],
+            )
+
+        kwds = {}
+        if timeout is not None:
+            kwds['timeout'] = aiohttp.ClientTimeout(total=timeout)
+
+        async with self.semaphore:
+            async with self.client.request(method, url,
+                                           params=self._strip(params),
+                                           data=self._strip(data),
+                                           **kwds) as resp:
+                content = await resp.read()
+                text = await resp.text()
+
+        return _AsyncResponse(resp.status, resp.headers, content, text)
+
+    async def acquire(self, limiter, endpoint=None):
+        """
+        Waits until the limiter (if not None) allows a call to an endpoint,
+        returning its limits.Slot. See limits.acquire.
+        """
+        if limiter is None:
+            return limits.Slot(endpoint)
+
+        limiter.queue(1)
+
+        try:
+            if limiter.bucket is not None:
+                wait = limiter.bucket.reserve()
+
+                if wait:
+                    await asyncio.sleep(wait)
+
+            if limiter.concurrency is not None:
+                while not limiter.concurrency.try_acquire():
+                    self.ready.clear()
+                    await self.ready.wait()
+        finally:
+            limiter.queue(-1)
+
+        return limits.Slot(endpoint, functools.partial(self._release,
+                                                       limiter))
+
+    def _release(self, limiter):
+        limiter.release()
+        self.ready.set()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+
+class _AsyncApiCall(ems._ApiCall):
+    """
+    An _ApiCall which returns a coroutine rather than blocking on the request.
+    """
+    async def stream(self, path, **kwds):
+        """
+        Asynchronous generator of the objects found at the given path of
+        fields in the response. See _ApiCall.stream; here the response is
+        read in full before the objects are decoded.
+        """
+        parameters = self.build_parameters(kwds)
+
+        with metrics.measure(self.metrics, self.endpoint) as sample:
+            opened = await self._do_request(
+                parameters, functools.partial(self._open_stream, path,
+                                              sample=sample))
+
+            for obj in self._read_stream(sample, *opened):
+                yield obj
+
+
+class AsyncApiSession(ems._BaseApiSession):
+    """
+    A session whose calls return coroutines. The calls are those of
+    ApiSession, sharing its parameter schemas, response types and the steps
+    of each call, which are awaited here. stream=True searches and
+    iter_contacts and iter_customers return asynchronous generators. There
+    are no bulk methods, such as upsert_customers: gather the calls instead.
+
+    The session must be authenticated before use, either by awaiting
+    authenticate() or by using it as an async context manager:
+
+        async with AsyncApiSession(url, username, password) as api:
+            await api.get_entitlement(ent_id)
+
+    The login is only renewed in the background, if keep_alive is given,
+    when the session is used as a context manager.
+    """
+
+    _call_class = _AsyncApiCall
+
+    def __init__(self, url, username, password,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None,
+                 metrics=None, keep_alive=None, retry=None, limiter=None):
+        # Cache of responses, or None. See ApiSession.
+        self.cache = cache
+
+        # retry.RetryPolicy for failed calls, or None. See ApiSession.
+        self.retry = retry
+
+        # limits.Limiter of the session's calls, or None. See ApiSession.
+        self.limiter = limiter
+
+        # Collector of metrics.Samples, or None. See ApiSession.
+        self.metrics = metrics
+
+        # Transport for storing cookies and limiting concurrent requests
+        self.session = _AsyncTransport(max_concurrency)
+
+        # Authentication credentials
+        self.username, self.password = username, password
+
+        if url[-1] == '/':
+            self.baseurl = url
+        else:
+            self.baseurl = url + '/'
+
+        # See ApiSession
+        self._login = _AsyncLogin(self.authenticate)
+
+        # Seconds between renewals of the login, and the task renewing it
+        self.keep_alive = keep_alive
+        self._keep_alive = None
+
+    async def __aenter__(self):
+        await self._login.renew()
+
+        if self.keep_alive:
+            self._keep_alive = asyncio.ensure_future(
+                _keep_alive(self._login, self.keep_alive))
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        if self._keep_alive is not None:
+            self._keep_alive.cancel()
+            self._keep_alive = None
+
+        await self.session.close()
+
+    def pool_stats(self):
+        """
+        Returns the connection statistics of the session, as
+        ApiSession.pool_stats does.
+        """
+        return self.session.pool_stats()
+
+    async def _iter_pages(self, search, path, page_size, prefetch, **kwds):
+        """
+        Asynchronous generator walking the pages of a search method. See
+        ApiSession._iter_pages.
+        """
+        page_index = 1
+        response = await search(page_index=page_index, page_size=page_size,
+                                **kwds)
+
+        while response is not None:
+            items, last_page = ems._page_items(response, path, page_index,
+                                               page_size)
+            response = None
+            next_page = None
+
+            if items and not last_page:
+                page_index += 1
+
+                if prefetch:
+                    next_page = asyncio.ensure_future(
+                        search(page_index=page_index, page_size=page_size,
+                               **kwds))
+
+            try:
+                for item in items:
+                    yield item
+            except BaseException:
+                # Don't leave the next page running if the consumer stops.
+                if next_page is not None:
+                    next_page.cancel()
+
+                raise
+
+            if next_page is not None:
+                response = await next_page
+            elif items and not last_page:
+                response = await search(page_index=page_index,
+                                        page_size=page_size, **kwds)
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Concurrent execution of many ApiSession calls
+"""
+
+import collections
+import io
+import json
+import os
+import threading
+
+import six
+
+from concurrent import futures
+
+import ems
+
+from ems import exceptions as exc
+from ems.types import entitlements
+
+
+# Default number of threads making calls at once
+DEFAULT_MAX_WORKERS = 10
+
+
+def _collect(pending, ordered):
+    """
+    Waits for and removes finished futures from the pending queue, returning
+    their results. If ordered, only the first future in the queue is waited
+    for.
+    """
+    if ordered:
+        return [pending.popleft().result()]
+
+    done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+
+    for future in done:
+        pending.remove(future)
+
+    return [future.result() for future in done]
+
+
+# The outcome of a single call. Exactly one of value or error is set, error
+# being the EMSException raised by the call (or for EntitlementPipeline, any
+# exception raised for the item).
+BulkResult = collections.namedtuple(
+    'BulkResult', ['index', 'method', 'args', 'value', 'error']
+)
+
+
+class BulkExecutor(object):
+    """
+    Runs ApiSession calls across a bounded pool of threads. The threads share
+    the session, and with it the session cookie and connection pool.
+
+        executor = BulkExecutor(api, max_workers=20)
+        for result in executor.map('create_contact', contacts):
+            if result.error is not None:
+                ...
+
+    Calls are read lazily from the given iterable, keeping at most
+    max_pending calls queued or in progress.
+    """
+    def __init__(self, api, max_workers=DEFAULT_MAX_WORKERS,
+                 max_pending=None):
+        self.api = api
+        self.max_workers = max_workers
+
+        if max_pending is None:
+            max_pending = max_workers * 2
+
+        self.max_pending = max(max_pending, max_workers)
+
+    def _call(self, index, method, args):
+        func = getattr(self.api, method)
+
+        try:
+            if isinstance(args, dict):
+                value = func(**args)
+            else:
+                value = func(*args)
+        except exc.EMSException as e:
+            return BulkResult(index, method, args, None, e)
+
+        return BulkResult(index, method, args, value, None)
+
+    def run(self, calls, ordered=True):
+        """
+        Generator running the given (method name, arguments) pairs, where the
+        arguments are a dict of keyword arguments or a tuple of positional
+        arguments. Yields a BulkResult for each call, in the order of the calls
+        if ordered is True, otherwise as the calls complete.
+
+        EMS exceptions raised by a call are returned in its result, any other
+        exception is raised.
+        """
+        pending = collections.deque()
+
+        with futures.ThreadPoolExecutor(self.max_workers) as pool:
+            try:
+                for index, (method, args) in enumerate(calls):
+                    pending.append(
+                        pool.submit(self._call, index, method, args))
+
+                    while len(pending) >= self.max_pending:
+                        for result in _collect(pending, ordered):
+                            yield result
+
+                while pending:
+                    for result in _collect(pending, ordered):
+                        yield result
+            finally:
+                # Don't start any calls still queued if the consumer stops
+                for future in pending:
+                    future.cancel()
+
+    def map(self, method, args, ordered=True):
+        """
+        Generator running the method of the session for each of the given
+        arguments. See run().
+        """
+        return self.run(((method, a) for a in args), ordered=ordered)
+
+
+class EntitlementPipeline(object):
+    """
+    Creates entitlements in the same way as ApiSession.create_entitlement,
+    running each of its requests (the DRAFT PUT, the GET and the commit POST)
+    as a stage with its own pool of max_workers threads. Each entitlement is
+    passed on to the next stage as soon as its request completes, so the
+    stages work on different entitlements at the same time.
+
+    Items take the keyword arguments of create_entitlement. A fetch given by
+    an item overrides the pipeline's, but draft may not be False as the
+    entitlements are always created as drafts.
+
+    If a journal file is given, a line is appended to it when each
+    entitlement is created and when it is committed. Running the pipeline
+    again with the same journal and items skips the entitlements which were
+    committed and commits those which were only created, so that nothing is
+    created twice.
+    """
+    def __init__(self, api, max_workers=DEFAULT_MAX_WORKERS, max_pending=None,
+                 journal=None, fetch=True):
+        self.api = api
+        self.max_workers = max_workers
+
+        if max_pending is None:
+            max_pending = max_workers * 4
+
+        self.max_pending = max(max_pending, max_workers)
+
+        # Path of the journal file, or None
+        self.journal = journal
+        self.journal_lock = threading.Lock()
+
+        # Whether to return the committed Entitlement rather than its id
+        self.fetch = fetch
+
+        self.stages = (self._create, self._fetch, self._commit)
+
+        self.pools = None
+        self.stopped = threading.Event()
+
+    def _create(self, index, kwds, value):
+        ent = entitlements.Entitlement.create(**dict(
+            (k, v) for k, v in six.iteritems(kwds)
+            if k not in ('draft', 'fetch')))
+        ent_id = self.api._put_entitlement(ent)
+        self._record(index, 'created', ent_id)
+
+        return ent_id
+
+    def _fetch(self, index, kwds, ent_id):
+        ent = self.api.get_entitlement(ent_id)
+        ems._commit_entitlement(ent, kwds['start_date'], kwds['end_date'])
+
+        return ent_id, ent
+
+    def _commit(self, index, kwds, value):
+        ent_id, ent = value
+        fetch = kwds.get('fetch', self.fetch)
+
+        ent = self.api.update_entitlement(ent_id, ent, parse=fetch)
+        self._record(index, 'committed', ent_id)
+
+        if fetch:
+            return ent
+
+        return ent_id
+
+    def _record(self, index, stage, ent_id):
+        if self.journal is None:
+            return
+
+        line = json.dumps({'index': index, 'stage': stage, 'ent_id': ent_id})
+
+        with self.journal_lock:
+            with io.open(self.journal, 'a', encoding='utf-8') as f:
+                f.write(u'%s\n' % line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def load_journal(self):
+        """
+        Returns the last recorded (stage, entitlement id) for each item index
+        in the journal.
+        """
+        progress = {}
+
+        if self.journal is None or not os.path.exists(self.journal):
+            return progress
+
+        with io.open(self.journal, encoding='utf-8') as f:
+            for line in f:
+                # Skip a line left incomplete by an interrupted run
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+
+                progress[record['index']] = (record['stage'],
+                                             record['ent_id'])
+
+        return progress
+
+    def _run_stage(self, stage, index, kwds, value, result):
+        # Don't start on new entitlements once the consumer has stopped
+        if self.stopped.is_set() and stage == 0:
+            return
+
+        try:
+            value = self.stages[stage](index, kwds, value)
+        except Exception as e:
+            result.set_result(
+                BulkResult(index, 'create_entitlement', kwds, None, e))
+            return
+
+        if stage + 1 < len(self.stages):
+            self.pools[stage + 1].submit(self._run_stage, stage + 1, index,
+                                         kwds, value, result)
+        else:
+            result.set_result(
+                BulkResult(index, 'create_entitlement', kwds, value, None))
+
+    def run(self, items, ordered=True):
+        """
+        Generator creating an entitlement for each dict of keyword arguments
+        to ApiSession.create_entitlement, yielding a BulkResult for each in
+        the order of the items if ordered is True, otherwise as they complete.
+        Items already committed according to the journal are skipped.
+        """
+        progress = self.load_journal()
+        pending = collections.deque()
+
+        self.stopped.clear()
+        self.pools = [futures.ThreadPoolExecutor(self.max_workers)
+                      for _ in self.stages]
+
+        try:
+            for index, kwds in enumerate(items):
+                stage, ent_id = progress.get(index, (None, None))
+
+                if stage == 'committed':
+                    continue
+
+                result = futures.Future()
+                pending.append(result)
+
+                if not kwds.get('draft', True):
+                    result.set_result(BulkResult(
+                        index, 'create_entitlement', kwds, None,
+                        exc.ValidationException(
+                            'EntitlementPipeline only creates draft '
+                            'entitlements')))
+                elif stage == 'created':
+                    self.pools[1].submit(self._run_stage, 1, index, kwds,
+                                         ent_id, result)
+                else:
+                    self.pools[0].submit(self._run_stage, 0, index, kwds,
+                                         None, result)
+
+                while len(pending) >= self.max_pending:
+                    for result in _collect(pending, ordered):
+                        yield result
+
+            while pending:
+                for result in _collect(pending, ordered):
+                    yield result
+        finally:
+            # Entitlements already created are seen through to the end, so
+            # the pools are shut down in the order of the stages.
+            self.stopped.set()
+
+            for pool in self.pools:
+                pool.shutdown(wait=True)
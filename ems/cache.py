@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache for API responses
+"""
+
+import collections
+import threading
+
+try:
+    from time import monotonic
+except ImportError:
+    from monotonic import monotonic
+
+
+# Default number of responses held by the cache
+DEFAULT_MAX_ENTRIES = 1000
+
+# Default number of seconds a response is held for
+DEFAULT_TTL = 300
+
+
+class ResponseCache(object):
+    """
+    A thread safe, least recently used cache of API responses. Entries expire
+    ttl seconds after they are stored.
+
+    Entries may be tagged, e.g. with ('customer', 10) for a response which
+    describes the customer with id 10, so that all the entries for a
+    customer can be invalidated when it is modified.
+
+    Cached responses are shared between callers, so must not be modified.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 clock=monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+
+        # Key -> (expiry time, value, tags), least recently used first
+        self.entries = collections.OrderedDict()
+
+        # Tag -> set of keys
+        self.tags = {}
+
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remove(self, key):
+        _, _, tags = self.entries.pop(key)
+
+        for tag in tags:
+            keys = self.tags.get(tag)
+
+            if keys is not None:
+                keys.discard(key)
+
+                if not keys:
+                    del self.tags[tag]
+
+    def __contains__(self, key):
+        """
+        Returns whether an unexpired value is stored for the key, without
+        counting a hit or miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] > self.clock()
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for the key, or default if there is none or
+        it has expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None and entry[0] <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            # Move to the most recently used end
+            del self.entries[key]
+            self.entries[key] = entry
+
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, tags=()):
+        """
+        Stores a value, evicting the least recently used entries if the cache
+        is full.
+        """
+        tags = frozenset(tags)
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+            while self.entries and len(self.entries) >= self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+            self.entries[key] = (self.clock() + self.ttl, value, tags)
+
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+
+    def invalidate(self, *tags):
+        """
+        Removes the entries with any of the given tags.
+        """
+        with self.lock:
+            for tag in tags:
+                for key in list(self.tags.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def related_tags(self, tag):
+        """
+        Returns the set of tags of the entries with the given tag, e.g. the
+        customers of the cached responses describing a contact.
+        """
+        with self.lock:
+            return set(
+                other
+                for key in self.tags.get(tag, ())
+                for other in self.entries[key][2]
+            )
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+    def stats(self):
+        """
+        Returns the counters of the cache as a dict.
+        """
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
@@ -50,6 +50,22 @@ class XMLException(EMSException):
     pass
 
 
+class BadResponseException(EMSException):
+    """
+    Exceptions for responses which did not come from the Sentinel EMS API,
+    such as an error page from a proxy, or could not be parsed. transient is
+    whether making the call again may succeed, as for server errors and
+    unparseable bodies of successful responses.
+    """
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.transient = not 400 <= status_code < 500
+
+        message = "HTTP %s: %s" % (status_code, body[:200])
+        super(BadResponseException, self).__init__(message)
+
+
 class EMSAPIException(EMSException):
     """
     Exceptions pertaining to the Sentinel EMS API.
@@ -62,7 +78,7 @@ class EMSAPIException(EMSException):
             self.code = ems_error.code
             self.description = ems_error.description
 
-        message = "[%s] %s" % (ems_error.code, ems_error.description)
+        message = "[%s] %s" % (self.code, self.description)
         super(EMSException, self).__init__(message)
 
 
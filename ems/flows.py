@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Calls written once for both blocking and asyncio sessions
+
+A flow is a generator which yields what each step of a call returns, and is
+sent back its result. The steps are calls of the session or its transport,
+which return their result when blocking and an awaitable under asyncio, so
+running a flow either passes each value straight back (run) or awaits it
+first (ems.aio). Errors are raised into the flow at the yield in both cases,
+so it handles them as ordinary code would.
+
+Generators cannot return a value in Python 2, so the result of a flow is the
+value of its last yield, and a flow returns the result of a step with:
+
+    yield self.session.request(**args)
+    return
+"""
+
+import functools
+
+
+def run(flow):
+    """
+    Runs a flow whose steps block, returning its result.
+    """
+    value = None
+
+    try:
+        while True:
+            value = flow.send(value)
+    except StopIteration:
+        return value
+
+
+def flow(func):
+    """
+    Decorator making a method written as a flow run it with the transport of
+    its object (the session attribute), so that it returns its result or, in
+    an asyncio session, an awaitable of it.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwds):
+        return self.session.run(func(self, *args, **kwds))
+
+    return wrapper
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Client side limits on the rate and concurrency of API calls
+"""
+
+import contextlib
+import threading
+import time
+
+from ems import exceptions as exc
+from ems import retry
+
+try:
+    from time import monotonic
+except ImportError:
+    from monotonic import monotonic
+
+
+# Defaults of AdaptiveConcurrency
+DEFAULT_INITIAL_LIMIT = 8
+DEFAULT_MAX_LIMIT = 64
+DEFAULT_BACKOFF = 0.5
+DEFAULT_TOLERANCE = 2.0
+DEFAULT_MIN_DELAY = 0.05
+
+# Weight of each call in the moving average of latency
+_SMOOTHING = 0.1
+
+# Growth of the lowest latency seen per call, so that it adapts if the
+# server becomes slower for good
+_DRIFT = 0.01
+
+
+class TokenBucket(object):
+    """
+    Allows rate calls per second on average, and bursts of up to burst calls.
+    """
+    def __init__(self, rate, burst=None, clock=monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.clock = clock
+
+        self.tokens = self.burst
+        self.updated = clock()
+
+        self.lock = threading.Lock()
+
+        # Number of calls which waited for a token, and the seconds waited
+        self.waits = 0
+        self.waited = 0.0
+
+    def reserve(self):
+        """
+        Takes a token, returning the seconds to wait until it may be used.
+        """
+        with self.lock:
+            now = self.clock()
+
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+
+            if self.tokens >= 0:
+                return 0.0
+
+            wait = -self.tokens / self.rate
+
+            self.waits += 1
+            self.waited += wait
+
+            return wait
+
+
+class AdaptiveConcurrency(object):
+    """
+    Limits the number of calls in flight, adapting the limit to the server
+    by additive increase, multiplicative decrease (AIMD), as TCP does.
+
+    The limit grows by one for each limit calls which succeed, and is
+    multiplied by backoff when calls fail as the server is overloaded or the
+    average latency of an endpoint rises to tolerance times the lowest seen
+    for it, and by at least min_delay seconds. Latency is tracked per
+    endpoint, as some calls take much longer than others, and the absolute
+    threshold keeps ordinary variation in fast calls from counting. The
+    limit is only decreased once per average latency, so that the calls in
+    flight when the server became overloaded reduce it once.
+    """
+    def __init__(self, initial=DEFAULT_INITIAL_LIMIT, min_limit=1,
+                 max_limit=DEFAULT_MAX_LIMIT, backoff=DEFAULT_BACKOFF,
+                 tolerance=DEFAULT_TOLERANCE, min_delay=DEFAULT_MIN_DELAY,
+                 clock=monotonic):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.min_delay = min_delay
+        self.clock = clock
+
+        self.in_flight = 0
+
+        # Endpoint -> [lowest, moving average] latency of successful calls
+        self.latencies = {}
+
+        # Time the limit was last decreased, or None
+        self.last_decrease = None
+
+        self.increases = 0
+        self.decreases = 0
+
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+
+    def try_acquire(self):
+        """
+        Starts a call if the limit allows, returning whether it did.
+        """
+        with self.lock:
+            if self.in_flight >= int(self.limit):
+                return False
+
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        """
+        Waits until the limit allows a call, and starts it.
+        """
+        with self.ready:
+            while self.in_flight >= int(self.limit):
+                self.ready.wait()
+
+            self.in_flight += 1
+
+    def release(self):
+        """
+        Finishes a call, once its response has arrived.
+        """
+        with self.ready:
+            self.in_flight -= 1
+            self.ready.notify_all()
+
+    def observe(self, seconds, overloaded, endpoint=None):
+        """
+        Adapts the limit to a call to an endpoint which took seconds, and
+        overloaded the server or not.
+        """
+        with self.ready:
+            self._adapt(seconds, overloaded, endpoint)
+            self.ready.notify_all()
+
+    def _adapt(self, seconds, overloaded, endpoint):
+        latency = self.latencies.get(endpoint)
+
+        if not overloaded and seconds is not None:
+            if latency is None:
+                latency = self.latencies[endpoint] = [seconds, seconds]
+            else:
+                latency[0] = min(seconds, latency[0] * (1 + _DRIFT))
+                latency[1] += (seconds - latency[1]) * _SMOOTHING
+
+        congested = overloaded or (
+            latency is not None and
+            latency[1] > latency[0] * self.tolerance and
+            latency[1] - latency[0] > self.min_delay)
+
+        if not congested:
+            if self.limit < self.max_limit:
+                self.limit = min(self.limit + 1.0 / self.limit,
+                                 self.max_limit)
+                self.increases += 1
+
+            return
+
+        now = self.clock()
+
+        if self.last_decrease is not None and \
+                now - self.last_decrease < (latency[1] if latency else 0):
+            return
+
+        self.limit = max(self.limit * self.backoff, self.min_limit)
+        self.last_decrease = now
+        self.decreases += 1
+
+
+class Limiter(object):
+    """
+    Limits the calls of a session, given either or both of a rate, in calls
+    per second (see TokenBucket), and an AdaptiveConcurrency.
+
+    Calls failing with one of the given codes (by default the retryable
+    codes, which EMS gives when overloaded), timing out, losing their
+    connection or getting a transient BadResponseException count as
+    overloading the server.
+    """
+    def __init__(self, rate=None, burst=None, concurrency=None,
+                 codes=retry.RETRYABLE_CODES, sleep=time.sleep):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.concurrency = concurrency
+        self.codes = frozenset(codes)
+        self.sleep = sleep
+
+        self.lock = threading.Lock()
+
+        # Number of calls waiting to start
+        self.queued = 0
+
+    def is_overload(self, error):
+        """
+        Returns whether a call failing with the error overloaded the server.
+        """
+        if error is None:
+            return False
+
+        if isinstance(error, exc.EMSAPIException):
+            return error.code in self.codes
+
+        if isinstance(error, exc.BadResponseException):
+            return error.transient
+
+        return retry.is_network_error(error)
+
+    def queue(self, delta):
+        with self.lock:
+            self.queued += delta
+
+    def acquire(self):
+        """
+        Waits until a call may start.
+        """
+        self.queue(1)
+
+        try:
+            if self.bucket is not None:
+                wait = self.bucket.reserve()
+
+                if wait:
+                    self.sleep(wait)
+
+            if self.concurrency is not None:
+                self.concurrency.acquire()
+        finally:
+            self.queue(-1)
+
+    def release(self):
+        """
+        Finishes a call, once its response has arrived, so that another may
+        start while it is decoded.
+        """
+        if self.concurrency is not None:
+            self.concurrency.release()
+
+    def observe(self, seconds, error, endpoint=None):
+        """
+        Adapts the limits to a call to an endpoint whose response took
+        seconds, and which failed with error, or None.
+        """
+        if self.concurrency is not None:
+            self.concurrency.observe(seconds, self.is_overload(error),
+                                     endpoint)
+
+    def gauges(self):
+        """
+        Returns the current limits and calls in flight and waiting, as a
+        dict.
+        """
+        gauges = {'queued': self.queued}
+
+        if self.concurrency is not None:
+            gauges.update({
+                'concurrency_limit': int(self.concurrency.limit),
+                'in_flight': self.concurrency.in_flight,
+            })
+
+        if self.bucket is not None:
+            gauges['rate_limit'] = self.bucket.rate
+
+        return gauges
+
+    def counters(self):
+        """
+        Returns the counts of limit changes and of waits for the rate, which
+        only ever increase, as a dict.
+        """
+        counters = {}
+
+        if self.concurrency is not None:
+            counters.update({
+                'limit_increases': self.concurrency.increases,
+                'limit_decreases': self.concurrency.decreases,
+            })
+
+        if self.bucket is not None:
+            counters.update({
+                'rate_waits': self.bucket.waits,
+                'rate_waited_seconds': self.bucket.waited,
+            })
+
+        return counters
+
+    def stats(self):
+        """
+        Returns the gauges and counters of the limiter, as a dict.
+        """
+        stats = self.gauges()
+        stats.update(self.counters())
+
+        return stats
+
+
+class Slot(object):
+    """
+    A call to an endpoint allowed by a Limiter. done() marks when its
+    response arrived, calling release to let another call start, so the
+    time taken to decode the response is neither taken as latency nor holds
+    up other calls. error may be set to an error given by the response
+    without raising it.
+    """
+    __slots__ = ('endpoint', 'release', 'start', 'end', 'error')
+
+    def __init__(self, endpoint=None, release=None):
+        self.endpoint = endpoint
+        self.release = release
+        self.start = monotonic()
+        self.end = None
+        self.error = None
+
+    def done(self):
+        if self.end is not None:
+            return
+
+        self.end = monotonic()
+
+        if self.release is not None:
+            self.release()
+
+    def seconds(self):
+        return (self.end or monotonic()) - self.start
+
+
+def acquire(limiter, endpoint=None):
+    """
+    Waits until a Limiter (if not None) allows a call to an endpoint,
+    returning its Slot.
+    """
+    if limiter is None:
+        return Slot(endpoint)
+
+    limiter.acquire()
+    return Slot(endpoint, limiter.release)
+
+
+@contextlib.contextmanager
+def observe(limiter, slot):
+    """
+    Context manager for the call of a Slot, which is released when the Slot
+    is done, or at the latest on leaving the context. The limiter (if not
+    None) adapts to the outcome of the call on leaving the context.
+    """
+    error = None
+
+    try:
+        yield slot
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        slot.done()
+
+        if limiter is not None:
+            limiter.observe(slot.seconds(), error or slot.error,
+                            slot.endpoint)
+
+
+@contextlib.contextmanager
+def limit(limiter, endpoint=None):
+    """
+    Context manager waiting until a Limiter (if not None) allows a call to
+    an endpoint, and yielding its Slot. See acquire and observe.
+    """
+    with observe(limiter, acquire(limiter, endpoint)) as slot:
+        yield slot
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Instrumentation of API calls
+
+An ApiSession given a collector, any object with a record(sample) method,
+passes it a Sample for each call it makes, timing the phases of the call.
+HistogramCollector keeps histograms of the samples in memory, which
+prometheus_text renders in the Prometheus text format.
+"""
+
+import bisect
+import contextlib
+import os
+import tempfile
+import threading
+
+import six
+
+from six.moves.urllib.parse import urlencode
+
+from ems import exceptions as exc
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from monotonic import monotonic as clock
+
+
+# Phases of a call timed by a Sample
+PHASES = ('encode', 'network', 'decode')
+
+# Default upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+class _Phase(object):
+    """
+    Context manager adding the time spent within it to a phase of a Sample.
+    """
+    __slots__ = ('sample', 'name', 'start')
+
+    def __init__(self, sample, name):
+        self.sample = sample
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.sample.phases[self.name] += clock() - self.start
+
+
+class Sample(object):
+    """
+    The measurements of a call to an endpoint of the API:
+
+    seconds: the time taken by the whole call.
+    phases: a dict of the seconds spent encoding the request, waiting for the
+        network (sending the request and reading the response) and decoding
+        the response.
+    bytes_sent, bytes_received: the size of the request and response bodies.
+    error_code: the EMS error code of a failed call, or the name of the
+        exception for other failures. None if the call succeeded.
+    """
+    __slots__ = ('endpoint', 'start', 'seconds', 'phases', 'bytes_sent',
+                 'bytes_received', 'error_code')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = clock()
+        self.seconds = 0.0
+        self.phases = dict((p, 0.0) for p in PHASES)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.error_code = None
+
+    def __repr__(self):
+        return '<Sample %s %.6fs %s>' % (self.endpoint, self.seconds,
+                                         self.error_code or 'ok')
+
+    def phase(self, name):
+        """
+        Returns a context manager timing one of the PHASES.
+        """
+        return _Phase(self, name)
+
+    def add(self, sample):
+        """
+        Adds the phases and bytes of a call made as part of this one.
+        """
+        for name, seconds in six.iteritems(sample.phases):
+            self.phases[name] += seconds
+
+        self.bytes_sent += sample.bytes_sent
+        self.bytes_received += sample.bytes_received
+
+
+@contextlib.contextmanager
+def measure(collector, endpoint, parent=None):
+    """
+    Context manager yielding a Sample of a call, which is passed to the
+    collector (if not None) when the call finishes. If a parent Sample is
+    given, the phases and bytes of the call are added to it.
+    """
+    sample = Sample(endpoint)
+
+    try:
+        yield sample
+    except exc.EMSAPIException as e:
+        sample.error_code = e.code
+        raise
+    except Exception as e:
+        sample.error_code = type(e).__name__
+        raise
+    finally:
+        sample.seconds = clock() - sample.start
+
+        if parent is not None:
+            parent.add(sample)
+
+        if collector is not None:
+            collector.record(sample)
+
+
+def body_size(body):
+    """
+    Returns the number of bytes sent for the body of a request, either text,
+    bytes or a dict of form parameters.
+    """
+    if body is None:
+        return 0
+
+    if isinstance(body, dict):
+        body = urlencode(dict((k, v) for k, v in six.iteritems(body)
+                              if v is not None))
+
+    if isinstance(body, six.text_type):
+        body = body.encode('utf-8')
+
+    return len(body)
+
+
+class Collector(object):
+    """
+    The interface of collectors. Subclasses override record.
+    """
+    def record(self, sample):
+        pass
+
+
+class CallbackCollector(Collector):
+    """
+    Passes each Sample to a function.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def record(self, sample):
+        self.callback(sample)
+
+
+class Histogram(object):
+    """
+    Counts of observed values falling at or below each bucket bound, with
+    their sum.
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        Returns a list of (bound, count of values at or below it), ending
+        with infinity.
+        """
+        total = 0
+        ret = []
+
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            ret.append((bound, total))
+
+        return ret
+
+    def quantile(self, q):
+        """
+        Returns an estimate of a quantile, as the upper bound of the bucket
+        holding it.
+        """
+        rank = q * self.count
+
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+
+        return None
+
+
+class HistogramCollector(Collector):
+    """
+    A thread safe collector holding, per endpoint, histograms of the time
+    taken by calls and by each of their phases, the number of calls by error
+    code and the bytes sent and received.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+
+        # (endpoint, phase) -> Histogram, with 'total' for the whole call
+        self.histograms = {}
+
+        # (endpoint, error code or None) -> number of calls
+        self.calls = {}
+
+        # endpoint -> [bytes sent, bytes received]
+        self.bytes = {}
+
+        self.lock = threading.Lock()
+
+    def _observe(self, endpoint, phase, seconds):
+        key = (endpoint, phase)
+        histogram = self.histograms.get(key)
+
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+
+        histogram.observe(seconds)
+
+    def record(self, sample):
+        endpoint = sample.endpoint
+
+        with self.lock:
+            self._observe(endpoint, 'total', sample.seconds)
+
+            for phase, seconds in six.iteritems(sample.phases):
+                self._observe(endpoint, phase, seconds)
+
+            key = (endpoint, sample.error_code)
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+            sizes = self.bytes.setdefault(endpoint, [0, 0])
+            sizes[0] += sample.bytes_sent
+            sizes[1] += sample.bytes_received
+
+    def histogram(self, endpoint, phase='total'):
+        """
+        Returns the Histogram of a phase of the calls to an endpoint, or None
+        if there have been none.
+        """
+        return self.histograms.get((endpoint, phase))
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.calls.clear()
+            self.bytes.clear()
+
+
+def _labels(**kwds):
+    return u','.join(
+        u'%s="%s"' % (k, six.text_type(v).replace(u'\\', u'\\\\')
+                      .replace(u'"', u'\\"').replace(u'\n', u'\\n'))
+        for k, v in sorted(kwds.items())
+    )
+
+
+def _number(value):
+    if value == float('inf'):
+        return u'+Inf'
+
+    return repr(value) if isinstance(value, float) else six.text_type(value)
+
+
+def prometheus_text(collector, prefix='ems', gauges=None, counters=None):
+    """
+    Returns the contents of a HistogramCollector in the Prometheus text
+    exposition format. gauges is a dict of names to current values to add,
+    such as the gauges() of a limits.Limiter, and counters one of names to
+    values which only increase, such as its counters(), which are named with
+    a _total suffix.
+    """
+    lines = []
+
+    with collector.lock:
+        histograms = sorted(six.iteritems(collector.histograms))
+        calls = sorted(six.iteritems(collector.calls),
+                       key=lambda i: (i[0][0], six.text_type(i[0][1])))
+        sizes = sorted((k, tuple(v)) for k, v in
+                       six.iteritems(collector.bytes))
+
+        # Copies so the histograms are consistent with each other
+        histograms = [(k, h.cumulative(), h.sum, h.count)
+                      for k, h in histograms]
+
+    name = prefix + '_call_seconds'
+    lines.append(u'# HELP %s Time taken by API calls, by phase.' % name)
+    lines.append(u'# TYPE %s histogram' % name)
+
+    for (endpoint, phase), buckets, total, count in histograms:
+        for bound, value in buckets:
+            lines.append(u'%s_bucket{%s} %d' % (
+                name, _labels(endpoint=endpoint, phase=phase,
+                              le=_number(bound)), value))
+
+        labels = _labels(endpoint=endpoint, phase=phase)
+        lines.append(u'%s_sum{%s} %s' % (name, labels, _number(total)))
+        lines.append(u'%s_count{%s} %d' % (name, labels, count))
+
+    name = prefix + '_calls_total'
+    lines.append(u'# HELP %s API calls, by error code.' % name)
+    lines.append(u'# TYPE %s counter' % name)
+
+    for (endpoint, code), count in calls:
+        lines.append(u'%s{%s} %d' % (
+            name, _labels(endpoint=endpoint,
+                          code='' if code is None else code), count))
+
+    for index, direction in enumerate(('sent', 'received')):
+        name = '%s_%s_bytes_total' % (prefix, direction)
+        lines.append(u'# HELP %s Bytes %s in the bodies of API calls.' %
+                     (name, direction))
+        lines.append(u'# TYPE %s counter' % name)
+
+        for endpoint, values in sizes:
+            lines.append(u'%s{%s} %d' % (name, _labels(endpoint=endpoint),
+                                         values[index]))
+
+    for key, value in sorted(six.iteritems(counters or {})):
+        name = '%s_%s_total' % (prefix, key)
+        lines.append(u'# TYPE %s counter' % name)
+        lines.append(u'%s %s' % (name, _number(value)))
+
+    for key, value in sorted(six.iteritems(gauges or {})):
+        name = '%s_%s' % (prefix, key)
+        lines.append(u'# TYPE %s gauge' % name)
+        lines.append(u'%s %s' % (name, _number(value)))
+
+    return u'\n'.join(lines) + u'\n'
+
+
+def write_prometheus(collector, filename, prefix='ems', gauges=None,
+                     counters=None):
+    """
+    Writes the contents of a HistogramCollector to a file in the Prometheus
+    text format, e.g. for the textfile collector of the node exporter. The
+    file is replaced atomically.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, path = tempfile.mkstemp(dir=directory, prefix='.ems-metrics-')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(prometheus_text(collector, prefix=prefix, gauges=gauges,
+                                    counters=counters).encode('utf-8'))
+
+        os.rename(path, filename)
+    except BaseException:
+        os.remove(path)
+        raise
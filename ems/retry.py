@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Retrying of failed API calls
+"""
+
+import random
+import sys
+import threading
+import time
+
+import requests
+import six
+
+from requests.packages.urllib3 import exceptions as urllib3_exceptions
+
+from ems import exceptions as exc
+from ems import flows
+
+try:
+    from time import monotonic
+except ImportError:
+    from monotonic import monotonic
+
+
+# Codes of the EMS errors which may succeed if the call is made again:
+# InternalErrorException and SystemException
+RETRYABLE_CODES = frozenset([
+    exc.InternalErrorException.error_code,
+    exc.SystemException.error_code,
+])
+
+# Default number of times a call is made before giving up
+DEFAULT_MAX_ATTEMPTS = 4
+
+# Default seconds waited before the first retry, doubling for each retry
+# after it up to the maximum
+DEFAULT_BACKOFF = 0.1
+DEFAULT_MAX_BACKOFF = 5.0
+
+# Kinds of failure. A call which failed before its request was sent may be
+# made again. One which failed afterwards may have taken effect, so is only
+# made again if it is idempotent, or a check finds it did not take effect.
+UNSENT = 'unsent'
+SENT = 'sent'
+
+# Errors raised by transports before a request was sent
+_unsent_errors = (requests.exceptions.ConnectTimeout,)
+
+# Errors raised by transports after which a request may have been sent
+_network_errors = (requests.exceptions.ConnectionError,
+                   requests.exceptions.Timeout)
+
+
+def register_errors(unsent=(), network=()):
+    """
+    Adds the exceptions raised by a transport to those which are retried.
+    unsent are raised before a request is sent, network afterwards.
+    """
+    global _unsent_errors, _network_errors
+
+    _unsent_errors += tuple(unsent)
+    _network_errors += tuple(network)
+
+
+def _is_unsent(error):
+    if isinstance(error, _unsent_errors):
+        return True
+
+    # requests raises ConnectionError wrapping a MaxRetryError for
+    # connections which could not be opened
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        reason = getattr(error.args[0], 'reason', None)
+        return isinstance(reason, urllib3_exceptions.NewConnectionError)
+
+    return False
+
+
+def is_network_error(error):
+    """
+    Returns whether an error was raised by a transport, e.g. for a dropped
+    connection or a timeout.
+    """
+    return isinstance(error, _network_errors + _unsent_errors)
+
+
+def limit_timeout(timeout, limit):
+    """
+    Returns a requests timeout, either seconds or a (connect, read) tuple,
+    limited to at most limit seconds.
+    """
+    if limit is None:
+        return timeout
+
+    if isinstance(timeout, tuple):
+        return tuple(limit if t is None else min(t, limit) for t in timeout)
+
+    if timeout is None:
+        return limit
+
+    return min(timeout, limit)
+
+
+class RetryPolicy(object):
+    """
+    Decides which failed calls are made again, and when.
+
+    Calls failing with EMS errors with one of the given codes (by default
+    RETRYABLE_CODES), timing out, losing their connection or getting a
+    transient BadResponseException are made up to max_attempts times.
+    Before each retry the policy waits a random time of up to backoff
+    seconds, doubling for each retry up to max_backoff ("full jitter"), so
+    that many clients failing together don't retry together.
+
+    If deadline is given, no call takes longer than that many seconds: a
+    call is not retried if it would wait past its deadline, or did, and
+    requests are given a timeout ending at the deadline.
+
+    Calls which are not idempotent, such as creating a contact, are only
+    made again if their request was never sent, or if a check that they did
+    not take effect is given. See call.
+    """
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 deadline=None, codes=RETRYABLE_CODES, clock=monotonic,
+                 sleep=time.sleep):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.codes = frozenset(codes)
+
+        self.clock = clock
+        self.sleep = sleep
+
+        self.random = random.Random()
+        self.lock = threading.Lock()
+
+        # Number of calls made again, and of failed calls given up on
+        self.retries = 0
+        self.failures = 0
+
+    def classify(self, error):
+        """
+        Returns UNSENT or SENT if a call which failed with the error may be
+        made again, depending on whether its request was sent, or None if it
+        may not.
+        """
+        if isinstance(error, exc.EMSAPIException):
+            return SENT if error.code in self.codes else None
+
+        if isinstance(error, exc.BadResponseException):
+            return SENT if error.transient else None
+
+        if _is_unsent(error):
+            return UNSENT
+
+        if is_network_error(error):
+            return SENT
+
+        return None
+
+    def start(self):
+        """
+        Returns the deadline of a call starting now, or None.
+        """
+        if self.deadline is None:
+            return None
+
+        return self.clock() + self.deadline
+
+    def remaining(self, deadline):
+        """
+        Returns the seconds left before a deadline, or None.
+        """
+        if deadline is None:
+            return None
+
+        return max(deadline - self.clock(), 0)
+
+    def delay(self, attempt, deadline):
+        """
+        Returns the seconds to wait before retrying a call which has failed
+        attempt times, or None if it should not be retried.
+        """
+        if attempt >= self.max_attempts:
+            return None
+
+        with self.lock:
+            delay = self.random.uniform(0, min(
+                self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+        if deadline is not None and self.clock() + delay >= deadline:
+            return None
+
+        return delay
+
+    def count(self, retried):
+        with self.lock:
+            if retried:
+                self.retries += 1
+            else:
+                self.failures += 1
+
+    def failed(self, error, attempt, deadline, idempotent=True, check=False):
+        """
+        Decides on a call which has failed attempt times, the last with the
+        error. Returns the seconds to wait before making it again and
+        whether check must be called first, or None if it is given up on.
+        check is whether the call has a check.
+        """
+        kind = self.classify(error)
+
+        if kind is None:
+            return None
+
+        delay = self.delay(attempt, deadline)
+
+        if kind == SENT and not idempotent and not check:
+            delay = None
+
+        if delay is None:
+            self.count(False)
+            return None
+
+        return delay, kind == SENT and not idempotent
+
+    def retrying(self, deadline):
+        """
+        Returns whether a call may be made again after waiting, which it may
+        not if its deadline passed while waiting.
+        """
+        retried = deadline is None or self.remaining(deadline) > 0
+        self.count(retried)
+
+        return retried
+
+    def call(self, func, idempotent=True, check=None):
+        """
+        Calls func with the seconds left before the call's deadline (or
+        None), making the call again as allowed by the policy.
+
+        If the call is not idempotent and failed after sending its request,
+        check is called before making it again. If check returns a value
+        other than None, such as a contact found by the email address it was
+        being created with, the call took effect and the value is returned.
+        Without a check, such calls are not made again.
+        """
+        return flows.run(self.steps(func, idempotent=idempotent, check=check))
+
+    def steps(self, func, idempotent=True, check=None, sleep=None):
+        """
+        Flow (see ems.flows) making a call as call does, whose steps are
+        func, check and sleep, by default the policy's sleep.
+        """
+        if sleep is None:
+            sleep = self.sleep
+
+        deadline = self.start()
+        attempt = 0
+
+        while True:
+            try:
+                yield func(self.remaining(deadline))
+                return
+            except Exception as e:
+                exc_info = sys.exc_info()
+                attempt += 1
+
+                decision = self.failed(e, attempt, deadline,
+                                       idempotent=idempotent,
+                                       check=check is not None)
+
+                if decision is None:
+                    six.reraise(*exc_info)
+
+                delay, checked = decision
+
+                if checked:
+                    ret = yield check()
+
+                    if ret is not None:
+                        return
+
+                yield sleep(delay)
+
+                if not self.retrying(deadline):
+                    six.reraise(*exc_info)
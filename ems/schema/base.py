@@ -14,8 +14,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import copy
-
 import six
 
 from lxml import etree
@@ -25,6 +23,12 @@ from ems.exceptions import ValidationException
 from ems.exceptions import XMLException
 
 from ems.schema import fields
+from ems.schema import writer
+
+
+# Marks a value in the store of a lazily parsed object which has not yet been
+# decoded from its element.
+_UNDECODED = object()
 
 
 def parse_meta(name, bases, dct):
@@ -68,14 +72,31 @@ def parse_fields(name, bases, dct):
     if '_SCHEMA_' not in dct:
         raise SchemaException('No _SCHEMA_ attribute found for %s' % name)
 
-    # Holds the fields from the schema definition
+    # Holds the fields from the schema definition. Field objects only describe
+    # the field and are shared by all instances of the class.
     schema_fields = {}
 
+    # Holds the fields in the order of their values in the instance store.
+    field_list = []
+
     # Holds a reverse lookup to the fields from their tag names. Used when
     # parsing an XML into an object.
     field_lookup = {}
 
-    for k, v in six.iteritems(dct['_SCHEMA_']):
+    # Holds the function decoding the elements of each tag into the value
+    # store, built once for the class rather than on every parse. The lazy
+    # decoders also hold the index of the field, and create nested objects
+    # which are themselves lazy.
+    decoders = {}
+    lazy_decoders = {}
+
+    # Holds the functions rendering each field's value as elements and as
+    # text, in the order of the fields.
+    encoders = []
+    writers = []
+    omit_empty = dct['_schema_meta']['omit_empty']
+
+    for i, (k, v) in enumerate(six.iteritems(dct['_SCHEMA_'])):
         if not isinstance(v, dict):
             raise SchemaException('Schema definitions must be dict objects')
 
@@ -87,23 +108,38 @@ def parse_fields(name, bases, dct):
             v['tag'] = k
 
         # Get field class from factory helper method.
-        schema_fields[k] = fields.factory(field_type, **v)
+        field = fields.factory(field_type, **v)
+        field.name = k
+        field.index = i
+
+        schema_fields[k] = field
+        field_list.append(field)
 
         # Lookup for the XML tag -> attribute name
         field_lookup[v['tag']] = k
-
-        # Create new property functions for the field values.
-        # Functions are wrapped to force 'k' to be evaluated now. Otherwise k
+        decoders[v['tag']] = field.decoder()
+        lazy_decoders[v['tag']] = (i, field.decoder(lazy=True))
+        encoders.append(field.encoder(omit_empty=omit_empty))
+        writers.append(field.writer(omit_empty=omit_empty))
+
+        # Create new property functions for the field values, which are held
+        # in the instance's value store at the index of the field.
+        # Functions are wrapped to force 'i' to be evaluated now. Otherwise i
         # will always be the value of the last element in the loop.
-        def wrap_get_f(k=k):
+        def wrap_get_f(i=i):
             def get_f(self):
-                return self._schema_fields[k].value
+                value = self._values[i]
+
+                if value is _UNDECODED:
+                    value = self._decode(i)
+
+                return value
 
             return get_f
 
-        def wrap_set_f(k=k):
+        def wrap_set_f(i=i):
             def set_f(self, value):
-                self._schema_fields[k].value = value
+                self._values[i] = value
 
             return set_f
 
@@ -112,7 +148,38 @@ def parse_fields(name, bases, dct):
     # Remove the original schema definition and add the new one
     del dct['_SCHEMA_']
     dct['_schema_fields'] = schema_fields
+    dct['_field_list'] = tuple(field_list)
     dct['_field_lookup'] = field_lookup
+    dct['_decoders'] = decoders
+    dct['_lazy_decoders'] = lazy_decoders
+    dct['_encoders'] = tuple(encoders)
+    dct['_writers'] = tuple(writers)
+
+    # Initial contents of the value store for new instances.
+    dct['_schema_defaults'] = tuple(f.default for f in field_list)
+
+
+def _copy_value(value):
+    """
+    Copies a value of a field for WebServiceObject.copy.
+    """
+    if isinstance(value, list):
+        return [_copy_value(v) for v in value]
+
+    if isinstance(value, WebServiceObject):
+        return value.copy()
+
+    return value
+
+
+def _snapshot(values):
+    """
+    Returns a snapshot of the values of an object for
+    WebServiceObject.is_validated. Lists are copied, as they may be changed
+    in place.
+    """
+    return [tuple(value) if isinstance(value, list) else value
+            for value in values]
 
 
 def webservice_meta(**kwds):
@@ -158,6 +225,9 @@ class WebServiceMeta(type):
         # Sets up the _schema_fields attribute.
         parse_fields(name, bases, dct)
 
+        # Instances only hold the value store defined by WebServiceObject.
+        dct.setdefault('__slots__', ())
+
         return super(WebServiceMeta, meta).__new__(meta, name, bases, dct)
 
 
@@ -167,26 +237,128 @@ class WebServiceObject(object):
     used by nested objects.
     Subclasses should also use the WebServiceMeta metaclass.
     """
+    # The field values, indexed by the position of each field in _field_list,
+    # a snapshot of the values when they were last validated and, for lazily
+    # parsed objects, the element values are decoded from.
+    __slots__ = ('_values', '_validated', '_element')
+
     def __init__(self, **kwds):
-        # Ensure that the field values are NOT shared across instances of the
-        # same class.
-        self._schema_fields = copy.deepcopy(self._schema_fields)
+        # Only the values are stored per instance. The Field objects are shared
+        # with the class.
+        self._values = list(self._schema_defaults)
+        self._validated = None
+        self._element = None
 
         # Allow any field to be set via keyword arguments
         for k, v in six.iteritems(kwds):
             if k in self._schema_fields:
-                self._schema_fields[k].value = v
+                self._values[self._schema_fields[k].index] = v
             else:
                 raise TypeError('%s got unexpected keyword argument %s' %
                                 (self.__class__.__name__, k))
 
+    def __getstate__(self):
+        # Elements cannot be pickled or copied, so lazily parsed objects are
+        # decoded first.
+        if self._element is not None:
+            self._load()
+
+        return self._values
+
+    def __setstate__(self, state):
+        self._values = state
+        self._validated = None
+        self._element = None
+
+    def copy(self):
+        """
+        Returns a copy of the object, copying the objects and lists held by
+        its fields. Other values are shared, being immutable.
+        """
+        if self._element is not None:
+            self._load()
+
+        obj = self.__class__.__new__(self.__class__)
+        obj._values = [_copy_value(v) for v in self._values]
+        obj._validated = None
+        obj._element = None
+
+        return obj
+
+    def _decode(self, index):
+        """
+        Decodes the value of a lazily parsed field from the elements of its
+        tag, returning the value.
+        """
+        field = self._field_list[index]
+        _, decode = self._lazy_decoders[field.tag]
+
+        values = self._values
+        values[index] = self._schema_defaults[index]
+
+        for elem in self._element.iterchildren(field.tag):
+            decode(values, elem)
+
+        value = values[index]
+
+        # The decoded value stands validated if the parsed values did.
+        snapshot = self._validated
+
+        if snapshot is not None and snapshot[index] is _UNDECODED:
+            snapshot[index] = _snapshot([value])[0]
+
+        return value
+
+    def _load(self):
+        """
+        Decodes all of the values of a lazily parsed object which have not been
+        decoded yet, releasing its element.
+        """
+        for i, value in enumerate(self._values):
+            if value is _UNDECODED:
+                self._decode(i)
+
+        self._element = None
+
     def validate(self):
         """
         Checks whether the values are valid for the class schema.
         Returns None if valid. Otherwise, raises ValidationException.
         """
-        for field in six.itervalues(self._schema_fields):
-            field.validate()
+        if self._element is not None:
+            self._load()
+
+        for field, value in zip(self._field_list, self._values):
+            field.validate(value)
+
+        self._validated = _snapshot(self._values)
+
+    def is_validated(self):
+        """
+        Returns whether the object was validated and none of its values have
+        been replaced or, for lists, changed since. Objects held by the
+        fields are validated as they are rendered, so are not checked.
+        """
+        snapshot = self._validated
+
+        if snapshot is None:
+            return False
+
+        for value, old in zip(self._values, snapshot):
+            if value is old:
+                continue
+
+            if not isinstance(value, list) or not isinstance(old, tuple):
+                return False
+
+            if len(value) != len(old):
+                return False
+
+            for item, old_item in zip(value, old):
+                if item is not old_item:
+                    return False
+
+        return True
 
     def is_valid(self):
         """
@@ -206,74 +378,238 @@ class WebServiceObject(object):
         if root_element is None:
             root_element = etree.Element(self._schema_meta['tag'])
 
-        for field in six.itervalues(self._schema_fields):
-            if self._schema_meta['validate']:
-                field.validate()
-
-            children = field.to_element(
-                omit_empty=self._schema_meta['omit_empty'],
-                omit_blank=self._schema_meta['omit_blank'])
-
-            # Append each child element if the rendered elements form a list.
-            # This means that each child gets a root tag. E.g.
-            # <attribute>
-            #   <a>1</a>
-            # </attribute>
-            # <attribute>
-            #   <a>2</a>
-            # </attribute>
-            if isinstance(children, list):
-                [root_element.append(elem)
-                 for elem
-                 in children]
-
-            elif children is not None:
-                root_element.append(children)
+        if self._element is not None:
+            self._load()
+
+        # Unchanged values are not validated again.
+        if self._schema_meta['validate'] and not self.is_validated():
+            self.validate()
+
+        # Each field appends its elements to the root element. Lists get an
+        # element per value, e.g.
+        # <attribute>
+        #   <a>1</a>
+        # </attribute>
+        # <attribute>
+        #   <a>2</a>
+        # </attribute>
+        for encode, value in zip(self._encoders, self._values):
+            encode(root_element, value)
 
         return root_element
 
-    def render(self, pretty=False):
+    def write_to(self, out):
+        """
+        Writes the child elements of the object to a writer.XMLWriter.
+        """
+        if self._element is not None:
+            self._load()
+
+        if self._schema_meta['validate'] and not self.is_validated():
+            self.validate()
+
+        for write, value in zip(self._writers, self._values):
+            write(out, value)
+
+    def write(self, f, buffer_size=writer.DEFAULT_BUFFER_SIZE):
+        """
+        Writes the object as XML to a file-like object opened for bytes, in
+        the same form as render(). The XML is written in pieces as it is
+        generated rather than built as a tree of elements first.
+        """
+        tag = self._schema_meta['tag']
+
+        out = writer.XMLWriter(f, buffer_size=buffer_size)
+        out.append(u'<%s>' % tag)
+
+        self.write_to(out)
+
+        if out.position() == 1:
+            out.parts[-1] = u'<%s/>' % tag
+        else:
+            out.append(u'</%s>' % tag)
+
+        out.flush()
+
+    def render(self, pretty=False, backend='lxml'):
         """
         Renders the object into an XML string representation.
+
+        The 'lxml' backend builds the elements with to_element and serializes
+        them. The 'stream' backend writes the text directly with write(),
+        using less memory for large objects, but cannot pretty print.
         """
+        if backend == 'stream':
+            if pretty:
+                raise ValueError('The stream backend cannot pretty print')
+
+            f = six.BytesIO()
+            self.write(f)
+            return f.getvalue()
+
+        if backend != 'lxml':
+            raise ValueError('Unknown render backend: %s' % backend)
+
         element = self.to_element()
         return etree.tostring(element, pretty_print=pretty)
 
     @classmethod
-    def parse(cls, root_element, strict=True):
+    def parse(cls, root_element, strict=True, lazy=False):
         """
         Returns a new instance of the class from an XML.
+
+        If lazy is True, the object keeps a reference to the element, and each
+        field (and nested object) is decoded when it is first read. Errors in
+        the values of the fields are then raised on access, only unexpected
+        elements being found by the parse.
+
+        If strict is True, the parsed values are taken as validated, so are
+        not validated again when rendered unless changed.
         """
-        # New instance of myself to return
-        obj = cls()
+        # New instance of myself to return, skipping the keyword arguments
+        # handling of __init__.
+        obj = cls.__new__(cls)
+        obj._values = values = list(cls._schema_defaults)
+        obj._validated = None
+        obj._element = None
+
+        if lazy:
+            lazy_decoders = cls._lazy_decoders
+
+            for elem in root_element:
+                decoder = lazy_decoders.get(elem.tag, None)
+
+                if decoder is None and strict:
+                    raise XMLException('Unexpected element: %s' % elem.tag)
+                elif decoder is None:
+                    continue
+
+                values[decoder[0]] = _UNDECODED
+                obj._element = root_element
+
+            if strict:
+                obj._validated = _snapshot(values)
+
+            return obj
+
+        decoders = cls._decoders
 
         for elem in root_element:
-            attr_name = cls._field_lookup.get(elem.tag, None)
+            decode = decoders.get(elem.tag, None)
 
-            if attr_name is None and strict:
+            if decode is None and strict:
                 raise XMLException('Unexpected element: %s' % elem.tag)
-            elif attr_name is None:
+            elif decode is None:
                 continue
 
-            # Field objects should provide a parse method
-            obj._schema_fields[attr_name].parse(elem)
+            decode(values, elem)
+
+        if strict:
+            obj._validated = _snapshot(values)
 
         return obj
 
     @classmethod
-    def from_file(cls, filename, strict=True):
+    def from_file(cls, filename, strict=True, lazy=False):
         """
         Parse an XML from a file.
         """
         tree = etree.parse(filename)
         root = tree.getroot()
 
-        return cls.parse(root, strict=strict)
+        return cls.parse(root, strict=strict, lazy=lazy)
 
     @classmethod
-    def from_text(cls, text, strict=True):
+    def from_text(cls, text, strict=True, lazy=False):
         """
         Parse an XML from a string.
         """
         bytes_ = six.BytesIO(text.encode('utf-8'))
-        return cls.from_file(bytes_)
+        return cls.from_file(bytes_, strict=strict, lazy=lazy)
+
+    @classmethod
+    def _resolve_path(cls, path):
+        """
+        Resolves a path of field names into the XML tags to match and the
+        class of the objects at the path.
+        """
+        tags = []
+        clazz = cls
+
+        for name in path:
+            field = clazz._schema_fields.get(name, None)
+
+            if not isinstance(field, fields.ComplexField):
+                raise SchemaException('%s is not a complex field of %s' %
+                                      (name, clazz.__name__))
+
+            tags.append(field.tag)
+            clazz = field.clazz
+
+        return tags, clazz
+
+    @classmethod
+    def _iterelements(cls, filename, path, strict=True, fallback=None):
+        """
+        Generator for iterparse, yielding the class and element of each
+        object at the path, or the fallback class and the root element.
+        """
+        tags, clazz = cls._resolve_path(path)
+
+        root = None
+
+        # Tags of the open elements below the root element.
+        open_tags = []
+
+        context = etree.iterparse(filename, events=('start', 'end'))
+
+        for event, elem in context:
+            if root is None:
+                root = elem
+                continue
+
+            if event == 'start':
+                open_tags.append(elem.tag)
+                continue
+
+            if open_tags == tags:
+                yield clazz, elem
+
+                # Drop the parsed element and its already processed siblings
+                # from the tree.
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+            elif (len(open_tags) == 1 and strict and
+                  elem.tag not in cls._field_lookup):
+
+                if fallback is None:
+                    raise XMLException('Unexpected element: %s' % elem.tag)
+
+                # Read the rest of the document into the tree.
+                for _ in context:
+                    pass
+
+                yield fallback, root
+                return
+
+            if open_tags:
+                open_tags.pop()
+
+    @classmethod
+    def iterparse(cls, filename, path, strict=True, fallback=None):
+        """
+        Incrementally parse an XML from a file, yielding the objects found at
+        the given path of field names one at a time. E.g.
+        SearchContactsResponse.iterparse(f, ('contacts', 'contact')) yields
+        each SearchContactsResponse.ContactList.Contact.
+
+        Elements are cleared once they have been parsed, so memory use does
+        not grow with the number of objects in the document. If the top level
+        elements do not match the schema and a fallback class is given, the
+        whole document is parsed as the fallback class and yielded instead.
+        """
+        for clazz, elem in cls._iterelements(filename, path, strict=strict,
+                                             fallback=fallback):
+            yield clazz.parse(elem, strict=strict)
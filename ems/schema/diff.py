@@ -0,0 +1,87 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+
+from six.moves import range
+
+from ems.schema import base
+from ems.schema import fields
+
+
+# A difference between two objects. path is the field names and list indexes
+# leading to the value, e.g. ('product_key', 0, 'start_date'). old or new is
+# None where a value or list item was added or removed.
+Change = collections.namedtuple('Change', ['path', 'old', 'new'])
+
+
+def diff(old, new):
+    """
+    Returns the list of Changes from one WebServiceObject to another, walking
+    the objects held by their fields. Items of lists are compared by
+    position. Compare with a copy() of the object taken when it was loaded to
+    find what has changed since.
+    """
+    changes = []
+    _diff_objects(old, new, (), changes)
+    return changes
+
+
+def _diff_objects(old, new, path, changes):
+    if old is new:
+        return
+
+    if type(old) is not type(new):
+        changes.append(Change(path, old, new))
+        return
+
+    for field in old._field_list:
+        old_value = getattr(old, field.name)
+        new_value = getattr(new, field.name)
+        field_path = path + (field.name,)
+
+        if isinstance(field, fields.ComplexField):
+            _diff_complex(old_value, new_value, field_path, changes)
+        elif old_value != new_value:
+            changes.append(Change(field_path, old_value, new_value))
+
+
+def _as_list(value):
+    if value is None:
+        return []
+
+    if isinstance(value, list):
+        return value
+
+    return [value]
+
+
+def _diff_complex(old, new, path, changes):
+    if isinstance(old, list) or isinstance(new, list):
+        old = _as_list(old)
+        new = _as_list(new)
+
+        for i in range(max(len(old), len(new))):
+            _diff_complex(old[i] if i < len(old) else None,
+                          new[i] if i < len(new) else None,
+                          path + (i,), changes)
+
+    elif (isinstance(old, base.WebServiceObject) and
+          isinstance(new, base.WebServiceObject)):
+        _diff_objects(old, new, path, changes)
+
+    elif old is not new:
+        changes.append(Change(path, old, new))
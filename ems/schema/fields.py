@@ -15,19 +15,38 @@
 # limitations under the License.
 
 import datetime
+import re
 
 import dateutil.parser
 import six
 
+from dateutil import tz
+
 from lxml import etree
 
 from ems.exceptions import SchemaException
 from ems.exceptions import ValidationException
 from ems.exceptions import XMLException
 
+from ems.schema.writer import escape
+
 
 field_classes = {}
 
+# Matches the ISO 8601 dates and times used by EMS, e.g. 2016-01-31,
+# 2016-01-31T12:30:00 or 2016-01-31 12:30:00.123+01:00
+_ISO_DATE = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d+))?)?'
+    r'(Z|[+-]\d{2}(?::?\d{2})?)?)?$'
+)
+
+# UTC offset in seconds -> tzinfo, shared by the parsed datetimes
+_TIMEZONES = {0: tz.tzutc()}
+
+# Number of date strings whose datetimes are kept by Date.from_text
+DATE_CACHE_SIZE = 1024
+
 
 def field_type(*field_names):
     """
@@ -42,6 +61,48 @@ def field_type(*field_names):
     return field_class
 
 
+def parse_iso_date(text):
+    """
+    Returns the datetime for an ISO 8601 date or time, or None if the text is
+    not in that format. Times without an offset are naive, as with dateutil.
+    """
+    match = _ISO_DATE.match(text)
+
+    if match is None:
+        return None
+
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+
+    tzinfo = None
+
+    if zone is not None:
+        if zone == 'Z':
+            offset = 0
+        else:
+            offset = int(zone[1:3]) * 3600
+
+            if len(zone) > 3:
+                offset += int(zone[-2:]) * 60
+
+            if zone[0] == '-':
+                offset = -offset
+
+        tzinfo = _TIMEZONES.get(offset, None)
+
+        if tzinfo is None:
+            tzinfo = _TIMEZONES.setdefault(offset, tz.tzoffset(None, offset))
+
+    # Digits beyond microseconds are dropped, as by dateutil
+    microsecond = int(fraction[:6].ljust(6, '0')) if fraction else 0
+
+    try:
+        return datetime.datetime(int(year), int(month), int(day),
+                                 int(hour or 0), int(minute or 0),
+                                 int(second or 0), microsecond, tzinfo)
+    except ValueError:
+        return None
+
+
 def factory(type_, **kwds):
     """
     Create new instance of a field.
@@ -83,22 +144,28 @@ class Field(object):
         # If this is > 1 or None then it's a list.
         self.max_occurs = 1
 
+        # The attribute name and the position of the value in the instance
+        # value store. Both are assigned by the WebServiceMeta metaclass.
+        self.name = None
+        self.index = None
+
         for k, v in six.iteritems(kwds):
             self.__setattr__(k, v)
 
-        self.value = self.default
-
     def __str__(self):
         return "[%(class_name)s (%(tag_name)s)]" % {
             'class_name': self.__class__.__name__,
             'tag_name': self.tag,
         }
 
-    def __len__(self):
-        if self.value is None:
+    def count(self, value):
+        """
+        Returns the number of values held by the given field value.
+        """
+        if value is None:
             return 0
-        elif self.is_list():
-            return len(self.value)
+        elif self.is_list(value):
+            return len(value)
         else:
             return 1
 
@@ -126,20 +193,20 @@ class Field(object):
         """
         return self.max_occurs is None or self.max_occurs > 1
 
-    def is_list(self):
+    def is_list(self, value):
         """
-        Returns whether the value of this field is a list.
+        Returns whether the given value of this field is a list.
         """
-        return isinstance(self.value, list)
+        return isinstance(value, list)
 
-    def is_none(self):
+    def is_none(self, value):
         """
-        Check whether the value of this field is None.
+        Check whether the given value of this field is None.
         """
-        if self.value is None:
+        if value is None:
             return True
 
-        if self.is_list() and all([i is None for i in self.value]):
+        if self.is_list(value) and all([i is None for i in value]):
             return True
 
         return False
@@ -164,69 +231,69 @@ class Field(object):
 
         self.from_text(self.to_text(value))
 
-    def validate(self):
+    def validate(self, value):
         """
-        Validates that a field's values are correct for the given schema of the
+        Validates that the given field value is correct for the schema of the
         field.
 
         Raises ValidationException if the field fails validation.
         """
         # If field is required. Populated lists require 1 non-None element.
-        if self.is_none() and self.required:
+        if self.is_none(value) and self.required:
             raise ValidationException("Field %s is required" % self)
 
         # Validate whether this should be a list, or otherwise
-        if self.is_list() and not self.is_list_type():
+        if self.is_list(value) and not self.is_list_type():
             raise ValidationException(
                 "More than one value encountered for field %s which isn't a "
                 "list type" % self)
 
         # Validate the occurs for values in the list and validate each element
-        if self.is_list():
-            if self.max_occurs and len(self) > self.max_occurs:
+        if self.is_list(value):
+            if self.max_occurs and self.count(value) > self.max_occurs:
                 raise ValidationException(
                     "Too many values for field: %s" % self)
 
-            if self.min_occurs and len(self) < self.min_occurs:
+            if self.min_occurs and self.count(value) < self.min_occurs:
                 raise ValidationException(
                     "Not enough values for field: %s" % self)
 
-            for val in self.value:
+            for val in value:
                 self.validate_one(val)
 
         # If it's a single value, validate it as-is
         else:
-            self.validate_one(self.value)
+            self.validate_one(value)
 
-    def is_valid(self):
+    def is_valid(self, value):
         """
         Convenience wrapper for the validate method to return a boolean value.
         """
         try:
-            self.validate()
+            self.validate(value)
         except ValidationException:
             return False
 
         return True
 
-    def to_element(self, **kwds):
+    def to_element(self, value, **kwds):
         """
-        Returns the field object as an XML element (lxml.etree.Element).
+        Returns the given field value as an XML element (lxml.etree.Element).
         """
-        if self.value is None and (self.omit_empty or
-                                   kwds.get('omit_empty', False)):
+        if value is None and (self.omit_empty or
+                              kwds.get('omit_empty', False)):
             return None
 
-        if self.is_list_type() and self.is_list():
+        if self.is_list_type() and self.is_list(value):
             elem_list = []
 
-            for value in self.value:
+            for item in value:
                 elem = etree.Element(self.tag)
 
-                if value is None:
+                if item is None:
                     elem.text = None
                 else:
-                    elem.text = self.to_text(value)
+                    elem.text = self.to_text(item)
 
                 elem_list.append(elem)
 
@@ -235,50 +302,153 @@ class Field(object):
         elif self.is_list_type():
             elem = etree.Element(self.tag)
 
-            if self.value is None:
+            if value is None:
                 elem.text = None
             else:
-                elem.text = self.to_text(self.value)
+                elem.text = self.to_text(value)
 
             return [elem]
 
         else:
             elem = etree.Element(self.tag)
 
-            if self.value is None:
+            if value is None:
                 elem.text = None
             else:
-                elem.text = self.to_text(self.value)
+                elem.text = self.to_text(value)
 
             return elem
 
-    def parse(self, element):
+    def encoder(self, omit_empty=False):
+        """
+        Returns a function appending the elements for a value of this field
+        to a parent element, as to_element does, for use by
+        WebServiceObject.to_element.
+        """
+        tag = self.tag
+        to_text = self.to_text
+        list_type = self.is_list_type()
+        omit = self.omit_empty or omit_empty
+        sub_element = etree.SubElement
+
+        def encode(parent, value):
+            if value is None:
+                if not omit:
+                    sub_element(parent, tag)
+
+            elif list_type and isinstance(value, list):
+                for item in value:
+                    elem = sub_element(parent, tag)
+
+                    if item is not None:
+                        elem.text = to_text(item)
+
+            else:
+                sub_element(parent, tag).text = to_text(value)
+
+        return encode
+
+    def writer(self, omit_empty=False):
         """
-        Parse an lxml.etree element to populate the values of the field. Raises
-        an XMLException if the XML is invalid for this field.
+        Returns a function writing the elements for a value of this field as
+        text to a writer.XMLWriter, producing the same XML as encoder().
+        """
+        start = u'<%s>' % self.tag
+        end = u'</%s>' % self.tag
+        empty = u'<%s/>' % self.tag
+
+        to_text = self.to_text
+        list_type = self.is_list_type()
+        omit = self.omit_empty or omit_empty
+
+        def write(out, value):
+            if value is None:
+                if not omit:
+                    out.append(empty)
+
+            elif list_type and isinstance(value, list):
+                for item in value:
+                    if item is None:
+                        out.append(empty)
+                    else:
+                        out.append(start + escape(to_text(item)) + end)
+
+            else:
+                out.append(start + escape(to_text(value)) + end)
+
+        return write
+
+    def converter(self, lazy=False):
+        """
+        Returns a function converting an lxml.etree element into a single
+        value of this field. Raises an XMLException if the XML is invalid for
+        this field. lazy only applies to fields holding objects.
         """
         # The format of the value produced by parsing must be the result of the
         # from_text method.
-        if element.text is None:
-            element_value = None
-        else:
+        from_text = self.from_text
+
+        def convert(element):
+            text = element.text
+
+            if text is None:
+                return None
+
             try:
-                element_value = self.from_text(element.text)
+                return from_text(text)
             except Exception as e:
-                raise XMLException(e.message)
+                raise XMLException(six.text_type(e))
+
+        return convert
+
+    def decoder(self, lazy=False):
+        """
+        Returns a function decoding an lxml.etree element into the value store
+        of an instance, for use by WebServiceObject.parse. Whether the field
+        is a list is decided once here rather than for each element.
+        """
+        index = self.index
+        convert = self.converter(lazy=lazy)
+
+        if not self.is_list_type():
+            def decode(values, element):
+                values[index] = convert(element)
+
+            return decode
+
+        def decode_list(values, element):
+            value = values[index]
+
+            if value is None:
+                values[index] = [convert(element)]
+            elif isinstance(value, list):
+                value.append(convert(element))
+            else:
+                values[index] = [value, convert(element)]
+
+        return decode_list
+
+    def parse(self, element, value=None):
+        """
+        Parse an lxml.etree element and return the new value of the field,
+        given its current value. Raises an XMLException if the XML is invalid
+        for this field.
+        """
+        element_value = self.converter()(element)
 
         if self.is_list_type():
-            if self.value is None:
-                self.value = [element_value]
+            if value is None:
+                return [element_value]
 
-            elif isinstance(self.value, list):
-                self.value.append(element_value)
+            elif isinstance(value, list):
+                value.append(element_value)
+                return value
 
             else:
-                self.value = [self.value, element_value]
+                return [value, element_value]
 
         else:
-            self.value = element_value
+            return element_value
 
 
 class ComplexField(Field):
@@ -297,8 +467,25 @@ class ComplexField(Field):
         super(ComplexField, self).__init__(**kwds)
 
     # Replaces the from_text on Field class
-    def from_single_element(self, element):
-        return self.clazz.parse(element)
+    def from_single_element(self, element, lazy=False):
+        return self.clazz.parse(element, lazy=lazy)
+
+    def converter(self, lazy=False):
+        """
+        Returns a function converting an element with the field's class,
+        lazily decoding the new objects if lazy is True.
+        """
+        from_single_element = self.from_single_element
+
+        def convert(element):
+            try:
+                return from_single_element(element, lazy=lazy)
+            except XMLException:
+                raise
+            except Exception as e:
+                raise XMLException(six.text_type(e))
+
+        return convert
 
     # Replaces the to_text on Field class
     def to_single_element(self, value):
@@ -311,49 +498,99 @@ class ComplexField(Field):
 
         return root
 
-    def to_element(self, **kwds):
+    def encoder(self, omit_empty=False):
+        """
+        Returns a function appending the elements for a value of this field,
+        each rendered by the to_element method of the value.
+        """
+        tag = self.tag
+        list_type = self.is_list_type()
+        omit = self.omit_empty or omit_empty
+        sub_element = etree.SubElement
+
+        def encode(parent, value):
+            if value is None:
+                if not omit:
+                    sub_element(parent, tag)
+
+            elif list_type and isinstance(value, list):
+                for item in value:
+                    elem = sub_element(parent, tag)
+
+                    if item is not None:
+                        item.to_element(root_element=elem)
+
+            else:
+                value.to_element(root_element=sub_element(parent, tag))
+
+        return encode
+
+    def writer(self, omit_empty=False):
+        """
+        Returns a function writing the elements for a value of this field,
+        each written by the write_to method of the value.
+        """
+        start = u'<%s>' % self.tag
+        end = u'</%s>' % self.tag
+        empty = u'<%s/>' % self.tag
+
+        list_type = self.is_list_type()
+        omit = self.omit_empty or omit_empty
+
+        def write_one(out, value):
+            out.append(start)
+            position = out.position()
+
+            value.write_to(out)
+
+            # An element without children is written as an empty tag
+            if out.position() == position:
+                out.parts[-1] = empty
+            else:
+                out.append(end)
+
+            out.maybe_flush()
+
+        def write(out, value):
+            if value is None:
+                if not omit:
+                    out.append(empty)
+
+            elif list_type and isinstance(value, list):
+                for item in value:
+                    if item is None:
+                        out.append(empty)
+                    else:
+                        write_one(out, item)
+
+            else:
+                write_one(out, value)
+
+        return write
+
+    def to_element(self, value, **kwds):
         """ """
-        if self.value is None and (self.omit_empty or
-                                   kwds.get('omit_empty', False)):
+        if value is None and (self.omit_empty or
+                              kwds.get('omit_empty', False)):
             return None
 
-        if self.is_list_type() and self.is_list():
+        if self.is_list_type() and self.is_list(value):
             elem_list = []
 
-            for value in self.value:
-                elem = self.to_single_element(value)
+            for item in value:
+                elem = self.to_single_element(item)
                 elem_list.append(elem)
 
             return elem_list
 
         elif self.is_list_type():
-            elem = self.to_single_element(self.value)
+            elem = self.to_single_element(value)
             return [elem]
 
         else:
-            elem = self.to_single_element(self.value)
+            elem = self.to_single_element(value)
             return elem
 
-    def parse(self, element):
-        """ """
-        try:
-            element_value = self.from_single_element(element)
-        except Exception as e:
-            raise XMLException(e.message)
-
-        if self.is_list_type():
-            if self.value is None:
-                self.value = [element_value]
-
-            elif isinstance(self.value, list):
-                self.value.append(element_value)
-
-            else:
-                self.value = [self.value, element_value]
-
-        else:
-            self.value = element_value
-
 
 @field_type('str', 'string')
 class String(Field):
@@ -410,7 +647,18 @@ class Boolean(Field):
 class Date(Field):
     """
     xs:date XML type
+
+    ISO 8601 dates are parsed directly, other formats falling back to
+    dateutil unless the field is defined with 'fallback': False. The
+    datetimes of recently parsed strings are shared through a cache.
     """
+    # (date string, fallback) -> datetime, shared by all Date fields
+    _cache = {}
+
+    def __init__(self, **kwds):
+        self.fallback = True
+        super(Date, self).__init__(**kwds)
+
     def to_text(self, value):
         if isinstance(value, six.string_types):
             value = self.from_text(value)
@@ -425,10 +673,29 @@ class Date(Field):
                 'Cannot convert value %s to ISO datetime' % value)
 
     def from_text(self, text):
-        try:
-            return dateutil.parser.parse(text)
-        except ValueError as e:
-            raise XMLException(e.message)
+        key = (text, self.fallback)
+        value = self._cache.get(key, None)
+
+        if value is not None:
+            return value
+
+        value = parse_iso_date(text)
+
+        if value is None:
+            if not self.fallback:
+                raise XMLException('%s is not an ISO 8601 date' % text)
+
+            try:
+                value = dateutil.parser.parse(text)
+            except (ValueError, OverflowError) as e:
+                raise XMLException(six.text_type(e))
+
+        # Rather than tracking use, the cache is emptied when full
+        if len(self._cache) >= DATE_CACHE_SIZE:
+            self._cache.clear()
+
+        self._cache[key] = value
+        return value
 
 
 @field_type('choice')
@@ -451,8 +718,8 @@ class Choice(ComplexField):
         if self.strict:
             # Count the number of fields which aren't none
             populated_fields = [
-                f.is_none() for f
-                in six.itervalues(value._schema_fields)
+                f.is_none(v) for f, v
+                in zip(value._field_list, value._values)
             ].count(False)
 
             if populated_fields > 1:
@@ -0,0 +1,389 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import collections
+import datetime
+
+import six
+
+from ems.exceptions import SchemaException
+from ems.exceptions import XMLException
+
+from ems.schema import fields
+
+
+# Naive datetimes are held relative to this
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# Values of a boolean column
+_FALSE = 0
+_TRUE = 1
+_NONE = 2
+
+
+class _IntColumn(object):
+    """
+    Integers held as 64 bit values, with a byte for each marking whether the
+    value is present.
+    """
+    def __init__(self):
+        self.values = array.array('q')
+        self.present = bytearray()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        if not self.present[i]:
+            return None
+
+        return self.values[i]
+
+    def append(self, value):
+        if value is None:
+            self.values.append(0)
+            self.present.append(0)
+        else:
+            self.values.append(value)
+            self.present.append(1)
+
+    def extend(self, column):
+        self.values.extend(column.values)
+        self.present.extend(column.present)
+
+    def to_numpy(self, numpy):
+        values = numpy.frombuffer(self.values, dtype=numpy.int64).copy()
+
+        if all(self.present):
+            return values
+
+        missing = numpy.frombuffer(bytes(self.present), dtype=numpy.uint8)
+        return numpy.ma.masked_array(values, mask=missing == 0)
+
+
+class _BoolColumn(object):
+    """
+    Booleans held as a byte each, with a third value for None.
+    """
+    def __init__(self):
+        self.values = bytearray()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        value = self.values[i]
+
+        if value == _NONE:
+            return None
+
+        return value == _TRUE
+
+    def append(self, value):
+        if value is None:
+            self.values.append(_NONE)
+        elif value is True:
+            self.values.append(_TRUE)
+        elif value is False:
+            self.values.append(_FALSE)
+        else:
+            raise XMLException('%s is not a boolean' % value)
+
+    def extend(self, column):
+        self.values.extend(column.values)
+
+    def to_numpy(self, numpy):
+        values = numpy.frombuffer(bytes(self.values), dtype=numpy.uint8)
+
+        if _NONE not in self.values:
+            return values == _TRUE
+
+        return numpy.ma.masked_array(values == _TRUE, mask=values == _NONE)
+
+
+class _StringColumn(object):
+    """
+    Strings held end to end as UTF-8 in a single buffer, with the offset of
+    the end of each, and a byte for each marking whether it is present.
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array.array('q')
+        self.present = bytearray()
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.ends)
+
+        if not self.present[i]:
+            return None
+
+        start = self.ends[i - 1] if i else 0
+        return self.data[start:self.ends[i]].decode('utf-8')
+
+    def append(self, value):
+        if value is None:
+            self.present.append(0)
+        else:
+            if not isinstance(value, six.text_type):
+                value = six.text_type(value)
+
+            self.data.extend(value.encode('utf-8'))
+            self.present.append(1)
+
+        self.ends.append(len(self.data))
+
+    def extend(self, column):
+        offset = len(self.data)
+
+        self.data.extend(column.data)
+        self.ends.extend(end + offset for end in column.ends)
+        self.present.extend(column.present)
+
+    def to_numpy(self, numpy):
+        values = numpy.empty(len(self), dtype=object)
+        values[:] = [self[i] for i in six.moves.range(len(self))]
+        return values
+
+
+class _DateColumn(object):
+    """
+    Naive datetimes held as 64 bit counts of microseconds since the epoch. Any
+    other values, such as datetimes with a timezone, are kept by index.
+    """
+    def __init__(self):
+        self.values = array.array('q')
+
+        # Index -> value not held in the array
+        self.others = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.values)
+
+        if i in self.others:
+            return self.others[i]
+
+        return _EPOCH + datetime.timedelta(microseconds=self.values[i])
+
+    def append(self, value):
+        if isinstance(value, datetime.datetime) and value.tzinfo is None:
+            delta = value - _EPOCH
+            self.values.append((delta.days * 86400 + delta.seconds) *
+                               1000000 + delta.microseconds)
+        else:
+            self.others[len(self.values)] = value
+            self.values.append(0)
+
+    def extend(self, column):
+        offset = len(self.values)
+
+        self.values.extend(column.values)
+        self.others.update(
+            (i + offset, v) for i, v in six.iteritems(column.others))
+
+    def to_numpy(self, numpy):
+        if not self.others:
+            values = numpy.frombuffer(self.values, dtype=numpy.int64)
+            return values.astype('datetime64[us]')
+
+        values = numpy.empty(len(self), dtype=object)
+        values[:] = [self[i] for i in six.moves.range(len(self))]
+        return values
+
+
+class _ObjectColumn(object):
+    """
+    Any other values, held in a list.
+    """
+    def __init__(self):
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def append(self, value):
+        self.values.append(value)
+
+    def extend(self, column):
+        self.values.extend(column.values)
+
+    def to_numpy(self, numpy):
+        values = numpy.empty(len(self.values), dtype=object)
+        values[:] = self.values
+        return values
+
+
+def _column(field):
+    if isinstance(field, fields.Integer) and not field.is_list_type():
+        return _IntColumn()
+
+    if isinstance(field, fields.Boolean) and not field.is_list_type():
+        return _BoolColumn()
+
+    if isinstance(field, fields.Date) and not field.is_list_type():
+        return _DateColumn()
+
+    if isinstance(field, fields.String) and not field.is_list_type():
+        return _StringColumn()
+
+    return _ObjectColumn()
+
+
+class Table(object):
+    """
+    The values of many objects of a WebServiceObject class, held as a column
+    for each field rather than as an object each. Integers are held in an
+    array, strings in a buffer of UTF-8, dates as integers and booleans as
+    bytes, so a table takes much less memory than the objects. Other values
+    are held in lists. Fields holding objects are not supported.
+
+        table = Table.from_file(SearchContactsResponse, f,
+                                ('contacts', 'contact'))
+        for row in table:
+            print(row.id, row.email)
+
+    Rows are named tuples of the values of the fields.
+    """
+    def __init__(self, clazz):
+        self.clazz = clazz
+        self.fields = clazz._field_list
+
+        for field in self.fields:
+            if isinstance(field, fields.ComplexField):
+                raise SchemaException('%s cannot be held in a table' % field)
+
+        self.names = tuple(f.name for f in self.fields)
+        self.Row = collections.namedtuple(clazz.__name__ + 'Row', self.names)
+
+        self._columns = tuple(_column(f) for f in self.fields)
+
+        # Tag -> function decoding an element into a row, as for an object,
+        # so that repeated elements of list fields are gathered in a list
+        self._decoders = clazz._decoders
+
+        self._defaults = clazz._schema_defaults
+
+    def __len__(self):
+        return len(self._columns[0]) if self._columns else 0
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+
+        return self.Row._make(c[i] for c in self._columns)
+
+    def __iter__(self):
+        for i in six.moves.range(len(self)):
+            yield self.Row._make(c[i] for c in self._columns)
+
+    def column(self, name):
+        """
+        Returns a list of the values of a field.
+        """
+        column = self._columns[self.names.index(name)]
+        return [column[i] for i in six.moves.range(len(column))]
+
+    def append(self, obj):
+        """
+        Adds the values of an object as a row.
+        """
+        for column, name in zip(self._columns, self.names):
+            column.append(getattr(obj, name))
+
+    def append_element(self, element, strict=True):
+        """
+        Decodes an element of the class's XML straight into a row.
+        """
+        row = list(self._defaults)
+        decoders = self._decoders
+
+        for elem in element:
+            decode = decoders.get(elem.tag, None)
+
+            if decode is None:
+                if strict:
+                    raise XMLException('Unexpected element: %s' % elem.tag)
+
+                continue
+
+            decode(row, elem)
+
+        for column, value in zip(self._columns, row):
+            column.append(value)
+
+    def extend(self, table):
+        """
+        Adds the rows of another table of the same class.
+        """
+        if table.clazz is not self.clazz:
+            raise TypeError('Cannot extend a table of %s with one of %s' %
+                            (self.clazz.__name__, table.clazz.__name__))
+
+        for column, other in zip(self._columns, table._columns):
+            column.extend(other)
+
+    def to_numpy(self):
+        """
+        Returns a dict of field names to NumPy arrays of their values. Integer
+        and boolean columns with missing values are masked arrays. Requires
+        NumPy.
+        """
+        import numpy
+
+        return collections.OrderedDict(
+            (name, column.to_numpy(numpy))
+            for name, column in zip(self.names, self._columns)
+        )
+
+    def to_pandas(self):
+        """
+        Returns a pandas DataFrame of the table. Requires pandas.
+        """
+        import pandas
+
+        return pandas.DataFrame(self.to_numpy(), columns=self.names)
+
+    @classmethod
+    def from_file(cls, root_class, filename, path, strict=True,
+                  fallback=None):
+        """
+        Incrementally parses an XML file of the root class into a table of
+        the objects at the given path of field names. See
+        WebServiceObject.iterparse. If the document is parsed as the fallback
+        class instead, that object is returned.
+        """
+        table = cls(root_class._resolve_path(path)[1])
+
+        for clazz, elem in root_class._iterelements(filename, path,
+                                                    strict=strict,
+                                                    fallback=fallback):
+            if clazz is fallback:
+                return fallback.parse(elem, strict=strict)
+
+            table.append_element(elem, strict=strict)
+
+        return table
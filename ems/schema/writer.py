@@ -0,0 +1,82 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+
+# Number of pieces of text held before they are written out
+DEFAULT_BUFFER_SIZE = 4096
+
+# Characters which cannot appear in XML 1.0, which lxml also rejects
+_INVALID_CHARS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Characters which are escaped or rejected
+_SPECIAL_CHARS = re.compile(u'[&<>\r\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def escape(text):
+    """
+    Escapes text for an element's content in the same way as lxml.
+    """
+    # Most text needs no escaping
+    if _SPECIAL_CHARS.search(text) is None:
+        return text
+
+    if _INVALID_CHARS.search(text) is not None:
+        raise ValueError('All strings must be XML compatible: Unicode or '
+                         'ASCII, no NULL bytes or control characters')
+
+    return (text.replace(u'&', u'&amp;')
+                .replace(u'<', u'&lt;')
+                .replace(u'>', u'&gt;')
+                .replace(u'\r', u'&#13;'))
+
+
+class XMLWriter(object):
+    """
+    Collects the pieces of text of an XML document, writing them to a file-like
+    object once buffer_size pieces are held. The output is ASCII, as with
+    etree.tostring, other characters being written as character references.
+    """
+    def __init__(self, out, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.out = out
+        self.buffer_size = buffer_size
+
+        self.parts = []
+        self.append = self.parts.append
+
+        # Number of pieces already written out
+        self.flushed = 0
+
+    def position(self):
+        """
+        Returns the number of pieces written to the writer.
+        """
+        return self.flushed + len(self.parts)
+
+    def maybe_flush(self):
+        if len(self.parts) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.parts:
+            return
+
+        text = u''.join(self.parts)
+        self.out.write(text.encode('ascii', 'xmlcharrefreplace'))
+
+        self.flushed += len(self.parts)
+        del self.parts[:]
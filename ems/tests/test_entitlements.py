@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import unittest
+
+from ems.types import entitlements
+
+
+def _entitlement(products=('P0', 'P1')):
+    """
+    Returns an Entitlement with a feature and license model with START_DATE
+    and END_DATE attributes for each product.
+    """
+    ent = entitlements.Entitlement.create(
+        customer_id=1, contact_id=2,
+        products=dict((name, '1.0') for name in products),
+        start_date=datetime.date(2016, 1, 1),
+        end_date=datetime.date(2017, 1, 1), num_activations=5)
+
+    for key in ent.product_key:
+        product = key.item.product
+        Feature = product.Feature
+        Model = Feature.LicenseModel
+        Attribute = Model.LicenseModelAttribute
+
+        product.feature = [Feature(license_model=[Model(attribute=[
+            Attribute(name='START_DATE', value='x'),
+            Attribute(name='END_DATE', value='y'),
+        ])])]
+
+    return ent
+
+
+class LicenseModelIndexTest(unittest.TestCase):
+
+    def test_lookup(self):
+        index = _entitlement().license_model_index()
+
+        self.assertEqual(len(index.attributes('START_DATE')), 2)
+        self.assertEqual(len(index.attributes('START_DATE', product='P1')),
+                         1)
+        self.assertEqual(index.update({'END_DATE': 'z'}), 2)
+        self.assertEqual(index.get('END_DATE'), 'z')
+
+    def test_cached(self):
+        ent = _entitlement()
+
+        self.assertIs(ent.license_model_index(), ent.license_model_index())
+
+    def test_product_keys_replaced(self):
+        ent = _entitlement()
+        ent.license_model_index()
+
+        ent.product_key = ent.product_key[:1]
+        index = ent.license_model_index()
+
+        self.assertFalse(index.is_stale())
+        self.assertEqual(index.update({'START_DATE': 'z'}), 1)
+
+        attrs = index.attributes('START_DATE')
+        model = ent.product_key[0].item.product.feature[0].license_model[0]
+        self.assertIs(attrs[0], model.attribute[0])
+
+    def test_product_keys_resized(self):
+        ent = _entitlement()
+        ent.license_model_index()
+
+        ent.product_key.extend(_entitlement(('P2',)).product_key)
+
+        self.assertEqual(
+            len(ent.license_model_index().attributes('START_DATE')), 3)
+
+    def test_nested_list_replaced(self):
+        ent = _entitlement()
+        ent.license_model_index()
+
+        model = ent.product_key[0].item.product.feature[0].license_model[0]
+        model.attribute = model.attribute[1:]
+
+        self.assertEqual(
+            len(ent.license_model_index().attributes('START_DATE')), 1)
+
+    def test_attribute_renamed(self):
+        ent = _entitlement()
+        attr = ent.license_model_index().attributes('START_DATE')[0]
+
+        attr.name = 'RENAMED'
+
+        self.assertIs(ent.license_model_index().attributes('RENAMED')[0],
+                      attr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+HTTP transport used by ApiSession
+"""
+
+import threading
+
+import requests
+
+from requests import adapters
+from requests.packages.urllib3 import connectionpool
+
+from ems import flows
+from ems import limits
+
+
+# Default number of per-host connection pools, and connections kept per pool
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+
+class _PoolStatsMixin(object):
+    """
+    Counts how connections are taken from an urllib3 connection pool.
+    """
+    def __init__(self, *args, **kwds):
+        super(_PoolStatsMixin, self).__init__(*args, **kwds)
+
+        self.num_gets = 0
+        self.num_waits = 0
+        self.stats_lock = threading.Lock()
+
+    def _get_conn(self, timeout=None):
+        with self.stats_lock:
+            self.num_gets += 1
+
+            # All of the pool's connections are in use
+            if self.pool is not None and self.pool.empty():
+                self.num_waits += 1
+
+        return super(_PoolStatsMixin, self)._get_conn(timeout=timeout)
+
+
+class HTTPConnectionPool(_PoolStatsMixin, connectionpool.HTTPConnectionPool):
+    pass
+
+
+class HTTPSConnectionPool(_PoolStatsMixin,
+                          connectionpool.HTTPSConnectionPool):
+    pass
+
+
+class HTTPAdapter(adapters.HTTPAdapter):
+    """
+    A requests transport adapter which keeps statistics on the use of its
+    connection pools.
+    """
+    def init_poolmanager(self, *args, **kwds):
+        super(HTTPAdapter, self).init_poolmanager(*args, **kwds)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': HTTPConnectionPool,
+            'https': HTTPSConnectionPool,
+        }
+
+    def pool_stats(self):
+        """
+        Returns the statistics summed over the connection pools:
+
+        requests: connections taken from the pools to send a request.
+        hits: requests reusing an open connection.
+        new_connections: connections opened.
+        waits: requests made while all of a pool's connections were in use.
+            These block if the pool is blocking, otherwise a connection is
+            opened which is discarded after the request.
+        """
+        stats = {
+            'requests': 0,
+            'hits': 0,
+            'new_connections': 0,
+            'waits': 0,
+        }
+
+        for key in list(self.poolmanager.pools.keys()):
+            pool = self.poolmanager.pools.get(key)
+
+            if pool is None:
+                continue
+
+            stats['requests'] += pool.num_gets
+            stats['new_connections'] += pool.num_connections
+            stats['waits'] += pool.num_waits
+
+        stats['hits'] = max(stats['requests'] - stats['new_connections'], 0)
+
+        return stats
+
+
+class Session(requests.Session):
+    """
+    A requests session applying a default timeout to its requests.
+
+    It also carries out the other steps of calls which wait (see ems.flows),
+    blocking until they finish. ems.aio has an asyncio equivalent.
+    """
+
+    # Waits between retries: None for the retry policy's own sleep
+    sleep = None
+
+    # Runs the flow of a call
+    run = staticmethod(flows.run)
+
+    def __init__(self, timeout=None):
+        super(Session, self).__init__()
+
+        # Either the seconds to wait or a (connect, read) tuple
+        self.timeout = timeout
+
+    def acquire(self, limiter, endpoint=None):
+        """
+        Waits until the limiter (if not None) allows a call to an endpoint,
+        returning its limits.Slot.
+        """
+        return limits.acquire(limiter, endpoint)
+
+    def request(self, method, url, **kwds):
+        if kwds.get('timeout', None) is None:
+            kwds['timeout'] = self.timeout
+
+        return super(Session, self).request(method, url, **kwds)
@@ -20,9 +20,164 @@ from ems.schema import base
 from ems.schema import restrictions
 
 
+def _as_list(value):
+    if value is None:
+        return []
+
+    if isinstance(value, list):
+        return value
+
+    return [value]
+
+
+def _name_version(identifier):
+    """
+    Returns the (name, version) of a product or feature identifier.
+    """
+    if identifier is None:
+        return None, None
+
+    for name_version in _as_list(identifier.name_version):
+        if name_version is not None:
+            return name_version.name, name_version.version
+
+    return None, None
+
+
+class LicenseModelIndex(object):
+    """
+    An index of the LicenseModelAttributes of an Entitlement by their name,
+    replacing walks of product_key, item, product, feature, license_model
+    and attribute. Attributes may also be filtered by the name and version of
+    their product and the name of their feature.
+
+        index = ent.license_model_index()
+        index.update({'START_DATE': start, 'END_DATE': end})
+
+    The index is built once, so lookups don't walk the entitlement.
+    Entitlement.license_model_index() rebuilds it once any of the fields it
+    walks (or the names of attributes and identifiers of products and
+    features) has been set, on any entitlement, or the list of product keys
+    has been resized. Lists below the product keys changed in place need a
+    call to refresh(). is_stale() checks every list and object walked, which
+    takes about as long as a rebuild.
+    """
+
+    # Number of times a field walked by indexes has been set
+    changes = 0
+
+    def __init__(self, entitlement):
+        self.entitlement = entitlement
+        self.refresh()
+
+    def refresh(self):
+        # LicenseModelIndex.changes when the index was built
+        self.built = LicenseModelIndex.changes
+
+        # Attribute name -> [(product name, product version, feature name,
+        # attribute)]
+        self.entries = {}
+
+        # (object, field name, value, length or None) for each value walked
+        self.shape = []
+
+        def walk(obj, name):
+            value = getattr(obj, name)
+            length = len(value) if isinstance(value, list) else None
+
+            self.shape.append((obj, name, value, length))
+            return _as_list(value)
+
+        for key in walk(self.entitlement, 'product_key'):
+            for item in walk(key, 'item'):
+                for product in walk(item, 'product'):
+                    product_name, version = _name_version(product.identifier)
+
+                    for feature in walk(product, 'feature'):
+                        feature_name, _ = _name_version(feature.identifier)
+
+                        for model in walk(feature, 'license_model'):
+                            for attr in walk(model, 'attribute'):
+                                entry = (product_name, version, feature_name,
+                                         attr)
+                                self.entries.setdefault(attr.name,
+                                                        []).append(entry)
+
+    def is_outdated(self):
+        """
+        Returns whether a field walked by the index has been set, or the list
+        of product keys replaced or resized, since it was built.
+        """
+        if self.built != LicenseModelIndex.changes:
+            return True
+
+        obj, name, value, length = self.shape[0]
+        current = getattr(obj, name)
+
+        return current is not value or \
+            (length is not None and len(current) != length)
+
+    def is_stale(self):
+        """
+        Returns whether the lists or objects walked by the index have changed.
+        """
+        for obj, name, value, length in self.shape:
+            current = getattr(obj, name)
+
+            if current is not value:
+                return True
+
+            if length is not None and len(current) != length:
+                return True
+
+        return False
+
+    def attributes(self, name, product=None, version=None, feature=None):
+        """
+        Returns the LicenseModelAttributes with the given name, optionally of
+        the given product name, product version and feature name.
+        """
+        return [
+            attr
+            for product_name, product_version, feature_name, attr
+            in self.entries.get(name, ())
+            if (product is None or product == product_name) and
+            (version is None or version == product_version) and
+            (feature is None or feature == feature_name)
+        ]
+
+    def get(self, name, product=None, version=None, feature=None):
+        """
+        Returns the value of the first matching attribute, or None.
+        """
+        for attr in self.attributes(name, product=product, version=version,
+                                    feature=feature):
+            return attr.value
+
+        return None
+
+    def update(self, values, product=None, version=None, feature=None):
+        """
+        Sets the value of every matching attribute for each of the names in a
+        dict of names to values, returning the number of attributes set.
+        """
+        count = 0
+
+        for name, value in six.iteritems(values):
+            for attr in self.attributes(name, product=product,
+                                        version=version, feature=feature):
+                attr.value = value
+                count += 1
+
+        return count
+
+
 @base.webservice_meta(tag='entitlement', omit_empty=True)
 class Entitlement(base.WebServiceObject):
 
+    # The LicenseModelIndex of the entitlement, once built
+    __slots__ = ('_license_model_index',)
+
     @base.webservice_meta(omit_empty=True)
     class CustomerIdentifier(base.WebServiceObject):
         _SCHEMA_ = {
@@ -641,7 +796,7 @@ class Entitlement(base.WebServiceObject):
     def create(cls, start_date, end_date, num_activations, products,
                customer_id, contact_id, cc_email=None, ref1=None, ref2=None,
                user_registration='OPTIONAL', send_notification=True,
-               type_='PARENT', as_whole=False):
+               type_='PARENT', as_whole=False, lifecycle_stage='DRAFT'):
 
         ent = cls()
         ent.start_date = start_date
@@ -652,7 +807,7 @@ class Entitlement(base.WebServiceObject):
         ent.cc_email = cc_email
         ent.type = type_
         ent.as_whole = as_whole
-        ent.lifecycle_stage = 'DRAFT'
+        ent.lifecycle_stage = lifecycle_stage
         ent.customer_identifier = ent.CustomerIdentifier(id=customer_id)
         ent.contact_identifier = ent.ContactIdentifier(id=contact_id)
         ent.user_registration = user_registration
@@ -677,3 +832,48 @@ class Entitlement(base.WebServiceObject):
 
         ent.product_key = product_keys
         return ent
+
+    def license_model_index(self):
+        """
+        Returns the LicenseModelIndex of the entitlement, built on first use
+        and rebuilt when outdated. See LicenseModelIndex.
+        """
+        index = getattr(self, '_license_model_index', None)
+
+        if index is None:
+            index = self._license_model_index = LicenseModelIndex(self)
+        elif index.is_outdated():
+            index.refresh()
+
+        return index
+
+
+def _track_changes(clazz, name):
+    """
+    Replaces the property of a field so that setting it outdates the
+    LicenseModelIndexes built before.
+    """
+    prop = clazz.__dict__[name]
+
+    def set_f(self, value):
+        LicenseModelIndex.changes += 1
+        prop.fset(self, value)
+
+    setattr(clazz, name, property(prop.fget, set_f))
+
+
+def _track_index_fields():
+    clazz = Entitlement
+
+    for name in ('product_key', 'item', 'product', 'feature',
+                 'license_model', 'attribute'):
+        _track_changes(clazz, name)
+        clazz = clazz._schema_fields[name].clazz
+
+        if name in ('product', 'feature'):
+            _track_changes(clazz, 'identifier')
+
+    _track_changes(clazz, 'name')
+
+
+_track_index_fields()
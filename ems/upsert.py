@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Opsview Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Creating or updating customers and contacts in as few calls as possible
+
+Syncing a record the simple way takes a call to fetch it, then one to create
+or update it, and for contacts one more to associate it with its customer.
+ApiSession.upsert_customer and upsert_contact skip the fetch when the
+record's state is cached or given, skip the update when nothing changed and
+create contacts with their customer. BulkUpsert fetches the state of all the
+records with a few search calls before upserting them.
+"""
+
+import collections
+
+import six
+
+import ems
+
+from ems import bulk
+
+
+# Actions taken by an upsert
+CREATED = 'created'
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+
+# Given as the existing state of a record known not to exist, such as one
+# missing from the results of a search
+ABSENT = object()
+
+_UNKNOWN = object()
+
+
+# The outcome of an upsert: the id of the record, the action taken, the
+# number of calls made and the number saved compared to fetching the record
+# then creating, updating or associating it as needed. A record fetched from
+# the cache counts as no call.
+UpsertResult = collections.namedtuple(
+    'UpsertResult', ['id', 'action', 'calls', 'saved']
+)
+
+
+def same(current, value):
+    """
+    Returns whether the current value of a field, as returned by the API,
+    equals a value given to an upsert.
+    """
+    if current is _UNKNOWN or current is None:
+        return False
+
+    if isinstance(value, bool):
+        return current == value
+
+    return six.text_type(current) == six.text_type(value)
+
+
+def changed(existing, values):
+    """
+    Returns the sorted names of the values which are not None and differ from
+    the fields of an existing record. Fields the record doesn't have, such as
+    the locale of a contact found by a search, count as differing.
+    """
+    return sorted(
+        name for name, value in six.iteritems(values)
+        if value is not None and
+        not same(getattr(existing, name, _UNKNOWN), value)
+    )
+
+
+def contact_customer(contact):
+    """
+    Returns the id of the customer of a contact, either a
+    ContactDetailsResponse or a contact found by a search, or None.
+    """
+    customer = getattr(contact, 'customer', None)
+
+    if customer is not None:
+        return customer.id
+
+    return getattr(contact, 'customer_id', None)
+
+
+def given(values):
+    """
+    Returns the values which are not None, as keyword arguments.
+    """
+    return dict((k, v) for k, v in six.iteritems(values) if v is not None)
+
+
+class BulkUpsert(object):
+    """
+    Upserts many customers or contacts, running the upserts for different
+    records at the same time as a bulk.BulkExecutor does. Iterating over it
+    upserts the items it was given, yielding a bulk.BulkResult for each:
+
+        upserts = api.upsert_contacts(contacts)
+        for result in upserts:
+            ...
+        print(upserts.stats['saved'])
+
+    If prefetch is True, all the customers or contacts are first fetched by
+    searching page by page, so that no record is fetched on its own. This
+    takes one call per page_size records in EMS, so only saves calls when
+    many records are being synced. If prefetch is None, the first page is
+    fetched, and the rest only if that takes fewer calls than there are
+    items; otherwise the records found on the first page are still not
+    fetched on their own.
+
+    stats holds the number of records by action and failed, the calls made
+    (including prefetch_calls) and the calls saved overall.
+    """
+    def __init__(self, api, kind, items=(),
+                 max_workers=bulk.DEFAULT_MAX_WORKERS, prefetch=None,
+                 page_size=None, ordered=True):
+        if kind not in ('customer', 'contact'):
+            raise ValueError('Unknown kind of record: %r' % (kind,))
+
+        self.api = api
+        self.kind = kind
+        self.items = items
+        self.max_workers = max_workers
+        self.prefetch = prefetch
+        self.page_size = page_size or ems.DEFAULT_PAGE_SIZE
+        self.ordered = ordered
+
+        self.stats = dict.fromkeys(
+            (CREATED, UPDATED, UNCHANGED, 'failed', 'calls', 'saved',
+             'prefetch_calls'), 0)
+
+    def __iter__(self):
+        return self.run(self.items, ordered=self.ordered)
+
+    def _key(self, value):
+        # EMS matches email addresses regardless of case
+        if self.kind == 'contact':
+            return value.lower()
+
+        return value
+
+    def _search(self, **kwds):
+        self.stats['prefetch_calls'] += 1
+
+        if self.kind == 'contact':
+            return self.api.search_contacts(**kwds)
+
+        return self.api.search_customers(**kwds)
+
+    def fetch_existing(self, max_calls=None):
+        """
+        Returns a dict of the customers by name or contacts by email address
+        fetched by searching, and whether it holds all of them. If fetching
+        them all would take max_calls calls or more, only the first page is
+        fetched, and none if max_calls is 0.
+        """
+        if max_calls is not None and max_calls < 1:
+            return {}, False
+
+        if self.kind == 'contact':
+            path, key = ('contacts', 'contact'), 'email'
+        else:
+            path, key = ('customers', 'customer'), 'name'
+
+        existing = {}
+        page_size = self.page_size
+        page_index = 1
+
+        while True:
+            response = self._search(page_index=page_index,
+                                    page_size=page_size)
+
+            records = response
+            for name in path:
+                records = getattr(records, name, None)
+
+            records = records or []
+
+            for record in records:
+                existing[self._key(getattr(record, key))] = record
+
+            if response.total is None:
+                last_page = len(records) < page_size
+            else:
+                last_page = page_index * page_size >= response.total
+
+            if last_page or not records:
+                return existing, True
+
+            if page_index == 1 and max_calls is not None and (
+                    response.total is None or
+                    -(-response.total // page_size) >= max_calls):
+                return existing, False
+
+            page_index += 1
+
+    def _args(self, items, existing, complete):
+        key = 'email' if self.kind == 'contact' else 'name'
+
+        for kwds in items:
+            if kwds.get('existing') is None:
+                record = existing.get(self._key(kwds[key]))
+
+                if record is None and complete:
+                    record = ABSENT
+
+                if record is not None:
+                    kwds = dict(kwds, existing=record)
+
+            yield kwds
+
+    def run(self, items, ordered=True):
+        """
+        Generator upserting each dict of keyword arguments to
+        ApiSession.upsert_customer or upsert_contact, yielding a
+        bulk.BulkResult for each in the order of the items if ordered is
+        True, otherwise as they complete. The value of each result is an
+        UpsertResult.
+        """
+        existing, complete = {}, False
+        prefetch_calls = self.stats['prefetch_calls']
+        count = len(items) if hasattr(items, '__len__') else None
+
+        if self.prefetch is None and count is not None:
+            existing, complete = self.fetch_existing(max_calls=count)
+        elif self.prefetch and count != 0:
+            existing, complete = self.fetch_existing()
+
+        prefetch_calls = self.stats['prefetch_calls'] - prefetch_calls
+        self.stats['calls'] += prefetch_calls
+        self.stats['saved'] -= prefetch_calls
+
+        executor = bulk.BulkExecutor(self.api, max_workers=self.max_workers)
+
+        for result in executor.map('upsert_' + self.kind,
+                                   self._args(items, existing, complete),
+                                   ordered=ordered):
+            if result.error is not None:
+                self.stats['failed'] += 1
+            else:
+                self.stats[result.value.action] += 1
+                self.stats['calls'] += result.value.calls
+                self.stats['saved'] += result.value.saved
+
+            yield result